@@ -1,6 +1,8 @@
+from typing import AsyncIterator, Optional
 from fastapi import HTTPException
 from app.exceptions.username_or_email import UsernameEmailInUser
 from app.exceptions.rule_title_in_use import TitleAlreadyInUse
+from app.exceptions.hasher_busy import HasherBusy
 from app.models.admin import (
     AdminCreate,
     AdminOut,
@@ -10,10 +12,34 @@ from app.models.admin import (
     RuleOut,
     RuleUpdate,
 )
-from app.models.users import UserOut, Enrollment, EnrollmentUpdate
+from app.models.page import Page
+from app.models.payload import CachedPayload
+from app.models.users import (
+    UserOut,
+    Enrollment,
+    EnrollmentUpdate,
+    UserWithEnrollments,
+    LockStatusResult,
+    EnrollmentRoleChange,
+    EnrollmentUpdateResult,
+)
 from app.services.service import Service
 
 
+async def empty_stream():
+    return
+    yield
+
+
+async def prepend(first, rest: AsyncIterator):
+    try:
+        yield first
+        async for item in rest:
+            yield item
+    finally:
+        await rest.aclose()
+
+
 class AdminController:
     def __init__(self, service: Service):
         self._service = service
@@ -23,6 +49,8 @@ class AdminController:
             return await self._service.create_admin(admin)
         except UsernameEmailInUser as e:
             raise HTTPException(status_code=409, detail=str(e))
+        except HasherBusy as e:
+            raise HTTPException(status_code=503, detail=str(e))
 
     async def get_admin(self, id: str) -> AdminOut:
         try:
@@ -34,8 +62,13 @@ class AdminController:
 
         return admin
 
-    async def get_all_admins(self) -> list[AdminOut]:
-        return await self._service.get_all_admins()
+    async def get_all_admins(
+        self, limit: Optional[int], after: Optional[str]
+    ) -> Page[AdminOut]:
+        try:
+            return await self._service.get_all_admins(limit, after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     async def delete_admin(self, id: str):
         try:
@@ -47,14 +80,36 @@ class AdminController:
             raise HTTPException(status_code=404, detail="Admin not found")
 
     async def login(self, login_data: AdminLogin) -> Token:
-        return await self._service.login_admin(login_data)
+        try:
+            return await self._service.login_admin(login_data)
+        except HasherBusy as e:
+            raise HTTPException(status_code=503, detail=str(e))
 
     async def get_all_users(self) -> list[UserOut]:
         return await self._service.get_all_users()
 
+    async def stream_all_users(self) -> AsyncIterator[UserOut]:
+        # Pull the first user before answering, so a failing gateway is still
+        # reported with its own status code instead of a cut-off stream
+        users = self._service.stream_all_users()
+        try:
+            first = await anext(users)
+        except StopAsyncIteration:
+            return empty_stream()
+
+        return prepend(first, users)
+
+    async def get_all_users_with_enrollments(self) -> list[UserWithEnrollments]:
+        return await self._service.get_all_users_with_enrollments()
+
     async def update_user_lock_status(self, uuid: str, locked: bool):
         return await self._service.update_user_lock_status(uuid, locked)
 
+    async def update_users_lock_status(
+        self, uuids: list[str], locked: bool
+    ) -> list[LockStatusResult]:
+        return await self._service.update_users_lock_status(uuids, locked)
+
     async def get_all_users_enrollment(self) -> list[Enrollment]:
         return await self._service.get_all_users_enrollment()
 
@@ -65,14 +120,27 @@ class AdminController:
             uuid, courseId, enrollmentData
         )
 
+    async def update_users_enrollment(
+        self, updates: list[EnrollmentRoleChange]
+    ) -> list[EnrollmentUpdateResult]:
+        return await self._service.update_users_enrollment(updates)
+
     async def create_rule(self, rule: RuleCreate) -> RuleOut:
         try:
             return await self._service.create_rule(rule)
         except TitleAlreadyInUse as e:
             raise HTTPException(status_code=409, detail=str(e))
 
-    async def get_all_rules(self) -> list[RuleOut]:
-        return await self._service.get_all_rules()
+    async def get_all_rules(
+        self, limit: Optional[int], after: Optional[str]
+    ) -> Page[RuleOut]:
+        try:
+            return await self._service.get_all_rules(limit, after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def get_all_rules_payload(self) -> CachedPayload:
+        return await self._service.get_all_rules_payload()
 
     async def get_rule(self, id: str) -> RuleOut:
         try:
@@ -85,7 +153,10 @@ class AdminController:
         return rule
 
     async def update_rule(self, id: str, admin_name: str, rule: RuleUpdate):
-        return await self._service.update_rule(id, admin_name, rule)
+        try:
+            return await self._service.update_rule(id, admin_name, rule)
+        except TitleAlreadyInUse as e:
+            raise HTTPException(status_code=409, detail=str(e))
 
     async def notify_rules(self):
         return await self._service.notify_rules()
@@ -9,26 +9,49 @@ from prometheus_client import (
     Gauge,
     Counter,
     Histogram,
+    multiprocess,
 )
-import threading
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
 import psutil
+import glob
 import os
+import re
+
+# With several workers, each one writes its metrics to files in this
+# directory and a scrape adds them all up. It must be set before the app
+# starts, as prometheus_client reads it when imported
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+# Resource usage, sampled when the metrics are scraped. The CPU percentage
+# covers the time since the previous scrape
+class ResourceUsageCollector(Collector):
+    def __init__(self):
+        self._process = psutil.Process()
+        self._process.cpu_percent(interval=None)
+
+    def describe(self):
+        yield GaugeMetricFamily("cpu_usage_percent", "CPU usage percentage")
+        yield GaugeMetricFamily("memory_usage_bytes", "Memory usage in bytes")
+
+    def collect(self):
+        with self._process.oneshot():
+            cpu = self._process.cpu_percent(interval=None)
+            rss = self._process.memory_info().rss
+
+        yield GaugeMetricFamily("cpu_usage_percent", "CPU usage percentage", cpu)
+        yield GaugeMetricFamily("memory_usage_bytes", "Memory usage in bytes", rss)
+
 
 registry = CollectorRegistry()
 PlatformCollector(registry=registry)
 ProcessCollector(registry=registry)
+registry.register(ResourceUsageCollector())
 
 # Prometheus Initialization
-CPU_USAGE = Gauge(
-    "cpu_usage_percent",
-    "CPU usage percentage",
-    registry=registry,
-)
-MEMORY_USAGE = Gauge(
-    "memory_usage_bytes",
-    "Memory usage in bytes",
-    registry=registry,
-)
 REQUEST_COUNT = Counter(
     "http_requests_total",
     "Total HTTP requests",
@@ -41,24 +64,106 @@ REQUEST_LATENCY = Histogram(
     ["method", "route"],
     registry=registry,
 )
+DROPPED_SERIES = Counter(
+    "http_metrics_dropped_series_total",
+    "Requests recorded under the overflow route because the label limit was hit",
+    registry=registry,
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "HTTP response body size",
+    ["method", "route"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+    registry=registry,
+)
+HASHER_WORKERS = Gauge(
+    "password_hasher_workers",
+    "Size of the password hashing worker pool",
+    registry=registry,
+    multiprocess_mode="livesum",
+)
+HASHER_QUEUE_LIMIT = Gauge(
+    "password_hasher_queue_limit",
+    "Maximum password hashing operations allowed to wait for a worker",
+    registry=registry,
+    multiprocess_mode="livesum",
+)
+HASHER_ACTIVE = Gauge(
+    "password_hasher_active",
+    "Password hashing operations currently running",
+    registry=registry,
+    multiprocess_mode="livesum",
+)
+HASHER_QUEUE_DEPTH = Gauge(
+    "password_hasher_queue_depth",
+    "Password hashing operations waiting for a worker",
+    registry=registry,
+    multiprocess_mode="livesum",
+)
+HASHER_REJECTED = Counter(
+    "password_hasher_rejected_total",
+    "Password hashing operations rejected because the pool was saturated",
+    registry=registry,
+)
+GATEWAY_CIRCUIT_STATE = Gauge(
+    "gateway_circuit_state",
+    "State of the gateway circuit breaker (0 closed, 1 half-open, 2 open)",
+    ["endpoint"],
+    registry=registry,
+    multiprocess_mode="livemax",
+)
+GATEWAY_CIRCUIT_REJECTED = Counter(
+    "gateway_circuit_rejected_total",
+    "Gateway calls failed fast because their circuit was open",
+    ["endpoint"],
+    registry=registry,
+)
+TOKEN_CACHE_HITS = Counter(
+    "auth_token_cache_hits_total",
+    "Bearer tokens found in the verified token cache",
+    registry=registry,
+)
+TOKEN_CACHE_MISSES = Counter(
+    "auth_token_cache_misses_total",
+    "Bearer tokens that had to be decoded and verified",
+    registry=registry,
+)
+
+
+LIVE_GAUGE_FILE = re.compile(r"gauge_live[a-z]+_(\d+)\.db")
+
+
+# In multiprocess mode the metrics come from the files of every worker. The
+# process and resource usage collectors are left out, they would only describe
+# whichever worker answered the scrape
+def scrape_registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return registry
+
+    # workers that crashed never got to mark themselves dead
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "gauge_live*_*.db")):
+        match = LIVE_GAUGE_FILE.fullmatch(os.path.basename(path))
+        if match and not psutil.pid_exists(int(match[1])):
+            mark_process_dead(int(match[1]))
+
+    workers = CollectorRegistry()
+    multiprocess.MultiProcessCollector(workers, path=MULTIPROC_DIR)
+    return workers
 
 
-# Resource usage tracking
-def track_usage():
-    process = psutil.Process(os.getpid())
-    while True:
-        CPU_USAGE.set(process.cpu_percent(interval=5.0))
-        MEMORY_USAGE.set(process.memory_info().rss)
+# Called when a worker exits, so its live gauges stop being reported
+def mark_process_dead(pid: int):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, path=MULTIPROC_DIR)
 
 
 class MetricsController:
     def __init__(self):
         self.router = APIRouter(prefix="/admins", tags=["admins"])
-        threading.Thread(target=track_usage, daemon=True).start()
 
     def get_metrics(self):
         return Response(
             status_code=200,
-            content=generate_latest(registry),
+            content=generate_latest(scrape_registry()),
             media_type=CONTENT_TYPE_LATEST,
         )
@@ -1,5 +1,5 @@
 from abc import abstractmethod, ABC
-from typing import Any, Optional, Dict
+from typing import Any, Iterable, Optional, Dict
 
 
 class DB(ABC):
@@ -7,18 +7,27 @@ class DB(ABC):
     def close(self):
         pass
 
+    # Unique indexes make `create` and `update` raise DuplicateKey on conflicts
+    @abstractmethod
+    async def create_index(self, collection: str, field: str, unique: bool = False):
+        pass
+
     @abstractmethod
     async def create(self, collection: str, data: Dict[str, Any]) -> Dict[str, Any]:
         pass
 
+    # Returns the document as it was before the update, or None if it doesn't exist
     @abstractmethod
     async def update(
         self, collection: str, id: str, data: Dict[str, Any]
     ) -> Optional[Dict[str, Any]]:
         pass
 
+    # `fields` limits the returned document to those fields, plus its id
     @abstractmethod
-    async def find_one(self, collection: str, id: str) -> Optional[Dict[str, Any]]:
+    async def find_one(
+        self, collection: str, id: str, fields: Optional[Iterable[str]] = None
+    ) -> Optional[Dict[str, Any]]:
         pass
 
     @abstractmethod
@@ -27,8 +36,17 @@ class DB(ABC):
     ) -> Optional[Dict[str, Any]]:
         pass
 
+    # Documents are returned ordered by id. `after` skips every document up to
+    # and including that id, `limit` caps how many are returned and `fields`
+    # works as in `find_one`
     @abstractmethod
-    async def get_all(self, collection: str) -> list[Dict[str, Any]]:
+    async def get_all(
+        self,
+        collection: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> list[Dict[str, Any]]:
         pass
 
     @abstractmethod
@@ -1,70 +1,164 @@
-from typing import Any, Optional, override, Dict, Tuple
+from typing import Any, Iterable, Optional, override, Dict, Set
 from app.databases.db import DB
+from app.exceptions.duplicate_key import DuplicateKey
 from collections import defaultdict
-from uuid import uuid4
+from bisect import bisect_left, bisect_right, insort
+from bson import ObjectId
 
 
 class DictDB(DB):
     def __init__(self):
         self._db = defaultdict(dict)
+        # ids of each collection in sorted order, like mongo's default _id
+        # order, so pages can start after an id with a binary search. ObjectIds
+        # mostly increase but their counter wraps, so they're inserted in place
+        self._ids = defaultdict(list)
+        # collection -> field -> value -> ids of the documents with that value
+        self._indexes: Dict[str, Dict[str, Dict[Any, Set[str]]]] = defaultdict(dict)
+        self._unique = defaultdict(set)
 
     @override
     def close(self):
         pass
 
+    @override
+    async def create_index(self, collection: str, field: str, unique: bool = False):
+        index = defaultdict(set)
+        for id, doc in self._db[collection].items():
+            value = doc.get(field)
+            if unique and index[value]:
+                raise DuplicateKey()
+            index[value].add(id)
+
+        self._indexes[collection][field] = index
+        if unique:
+            self._unique[collection].add(field)
+
+    # Ids of the documents where `field` equals `value`, from its index if the
+    # field has one or by scanning the collection otherwise
+    def _ids_where(self, collection: str, field: str, value: Any) -> Iterable[str]:
+        index = self._indexes[collection].get(field)
+        if index is not None:
+            return index.get(value, ())
+
+        docs = self._db[collection].items()
+        return [id for id, doc in docs if doc.get(field) == value]
+
+    def _check_unique(
+        self, collection: str, data: Dict[str, Any], id: Optional[str] = None
+    ):
+        for field in self._unique[collection] & data.keys():
+            if any(
+                other != id for other in self._ids_where(collection, field, data[field])
+            ):
+                raise DuplicateKey()
+
+    def _index(self, collection: str, doc: Dict[str, Any]):
+        for field, index in self._indexes[collection].items():
+            index[doc.get(field)].add(doc["id"])
+
+    def _unindex(self, collection: str, doc: Dict[str, Any]):
+        for field, index in self._indexes[collection].items():
+            ids = index[doc.get(field)]
+            ids.discard(doc["id"])
+            if not ids:
+                del index[doc.get(field)]
+
     @override
     async def create(self, collection: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        id = str(uuid4())
+        self._check_unique(collection, data)
+        id = str(ObjectId())
         full_data = {"id": id, **data}
         self._db[collection][id] = full_data
+        insort(self._ids[collection], id)
+        self._index(collection, full_data)
         return full_data
 
     @override
     async def update(
         self, collection: str, id: str, data: Dict[str, Any]
     ) -> Optional[Dict[str, Any]]:
-        value = self._db[collection].get(id)
-        if not value:
+        prev = self._db[collection].get(id)
+        if prev is None:
             return None
+        self._check_unique(collection, data, id)
 
-        self._db[collection][id] = {**value, **data}
-        return value
+        # a new dict is stored, so the one returned keeps the values before the
+        # update, like mongo's ReturnDocument.BEFORE
+        updated = {**prev, **data, "id": id}
+        self._unindex(collection, prev)
+        self._db[collection][id] = updated
+        self._index(collection, updated)
+        return prev
 
     @override
-    async def find_one(self, collection: str, id: str) -> Optional[Dict[str, Any]]:
-        return self._db[collection].get(id)
+    async def find_one(
+        self, collection: str, id: str, fields: Optional[Iterable[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        doc = self._db[collection].get(id)
+        return _project(doc, fields) if doc else None
 
     @override
     async def find_one_by_filter(
         self, collection: str, filter: Dict[str, Any]
     ) -> Optional[Dict[str, Any]]:
-        for doc in self._db[collection].values():
+        indexed = self._indexes[collection].keys() & filter.keys()
+        if indexed:
+            field = next(iter(indexed))
+            ids = self._ids_where(collection, field, filter[field])
+            docs = (self._db[collection][id] for id in ids)
+        else:
+            docs = self._db[collection].values()
+
+        for doc in docs:
             if all(doc.get(k) == v for k, v in filter.items()):
                 return doc
         return None
 
     @override
-    async def get_all(self, collection: str) -> list[Dict[str, Any]]:
-        return list(self._db[collection].values())
+    async def get_all(
+        self,
+        collection: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> list[Dict[str, Any]]:
+        ids = self._ids[collection]
+        start = bisect_right(ids, after) if after else 0
+        end = start + limit if limit else len(ids)
+        docs = self._db[collection]
+        return [_project(docs[id], fields) for id in ids[start:end]]
 
     @override
     async def delete(self, collection: str, id: str) -> bool:
-        return self._db[collection].pop(id, None) is not None
+        doc = self._db[collection].pop(id, None)
+        if doc is None:
+            return False
+
+        self._unindex(collection, doc)
+        ids = self._ids[collection]
+        i = bisect_left(ids, id)
+        if i < len(ids) and ids[i] == id:
+            del ids[i]
+        return True
 
     @override
     async def exists_with_username_email(
         self, collection: str, username: str, email: str
     ) -> bool:
-        for doc in self._db[collection].values():
-            if doc.get("username") == username:
-                return True
-            if doc.get("email") == email:
-                return True
-        return False
+        return bool(
+            self._ids_where(collection, "username", username)
+            or self._ids_where(collection, "email", email)
+        )
 
     @override
     async def exists_with_title(self, collection: str, title: str) -> bool:
-        for doc in self._db[collection].values():
-            if doc.get("title") == title:
-                return True
-        return False
+        return bool(self._ids_where(collection, "title", title))
+
+
+def _project(doc: Dict[str, Any], fields: Optional[Iterable[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return doc
+    projected = {field: doc[field] for field in fields if field in doc}
+    projected["id"] = doc["id"]
+    return projected
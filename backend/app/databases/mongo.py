@@ -1,8 +1,11 @@
-from typing import Any, Optional, override, Dict
+from typing import Any, Iterable, Optional, override, Dict
 from fastapi import HTTPException
 from app.databases.db import DB
+from app.exceptions.duplicate_key import DuplicateKey
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 
 class MongoDB(DB):
@@ -17,6 +20,12 @@ class MongoDB(DB):
         except Exception as e:
             raise ValueError("Invalid id") from e
 
+    # `_id` always comes back, and becomes the `id` of the returned documents
+    def _projection(self, fields: Optional[Iterable[str]]) -> Optional[Dict[str, int]]:
+        if fields is None:
+            return None
+        return {field: 1 for field in fields if field != "id"}
+
     @override
     def close(self):
         if self._client:
@@ -26,9 +35,15 @@ class MongoDB(DB):
     async def _try(self, f) -> Any:
         try:
             return await f()
+        except DuplicateKeyError as e:
+            raise DuplicateKey() from e
         except Exception as e:
             raise HTTPException(500, str(e))
 
+    @override
+    async def create_index(self, collection: str, field: str, unique: bool = False):
+        await self._db[collection].create_index(field, unique=unique)
+
     @override
     async def create(self, collection: str, data: Dict[str, Any]) -> Dict[str, Any]:
         async def inner():
@@ -41,24 +56,31 @@ class MongoDB(DB):
     async def update(
         self, collection: str, id: str, data: Dict[str, Any]
     ) -> Optional[Dict[str, Any]]:
-        async def inner():
-            prev = await self.find_one(collection, id)
-            if not prev:
-                return None
+        if not data:
+            return await self.find_one(collection, id)
 
-            await self._db[collection].update_one(
+        async def inner():
+            # the document before the update comes back from the same atomic
+            # operation, so no other write can land in between
+            prev = await self._db[collection].find_one_and_update(
                 {"_id": self._objectid(id)},
                 {"$set": data},
+                return_document=ReturnDocument.BEFORE,
             )
-
+            if prev:
+                prev["id"] = str(prev["_id"])
             return prev
 
         return await self._try(inner)
 
     @override
-    async def find_one(self, collection: str, id: str) -> Optional[Dict[str, Any]]:
+    async def find_one(
+        self, collection: str, id: str, fields: Optional[Iterable[str]] = None
+    ) -> Optional[Dict[str, Any]]:
         async def inner():
-            document = await self._db[collection].find_one({"_id": self._objectid(id)})
+            document = await self._db[collection].find_one(
+                {"_id": self._objectid(id)}, self._projection(fields)
+            )
             if document:
                 document["id"] = str(document["_id"])
             return document
@@ -78,10 +100,21 @@ class MongoDB(DB):
         return await self._try(inner)
 
     @override
-    async def get_all(self, collection: str) -> list[Dict[str, Any]]:
+    async def get_all(
+        self,
+        collection: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> list[Dict[str, Any]]:
+        query = {"_id": {"$gt": self._objectid(after)}} if after else {}
+        projection = self._projection(fields)
+
         async def inner():
             users = []
-            cursor = self._db[collection].find()
+            cursor = self._db[collection].find(query, projection).sort("_id", ASCENDING)
+            if limit:
+                cursor = cursor.limit(limit)
             async for doc in cursor:
                 doc["id"] = str(doc["_id"])
                 users.append(doc)
@@ -0,0 +1,3 @@
+class DuplicateKey(Exception):
+    def __init__(self):
+        super().__init__("A document with the same unique key already exists")
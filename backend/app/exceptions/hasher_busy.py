@@ -0,0 +1,3 @@
+class HasherBusy(Exception):
+    def __init__(self):
+        super().__init__("Too many concurrent password operations, try again later")
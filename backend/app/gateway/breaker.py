@@ -0,0 +1,110 @@
+from typing import Iterator
+from contextlib import contextmanager
+from enum import IntEnum
+from app.controllers.metrics import GATEWAY_CIRCUIT_STATE, GATEWAY_CIRCUIT_REJECTED
+import asyncio
+import httpx
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+class CircuitState(IntEnum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit for {name} is open")
+
+
+# Errors that say something about the gateway's health. 4xx answers mean the
+# gateway is up and working, so they don't count
+def is_gateway_failure(e: BaseException) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+# Each call goes through `with breaker.call():`. After `failure_threshold`
+# failures in a row the circuit opens and calls fail right away with
+# CircuitOpen. Once `reset_timeout` seconds pass it goes half-open and lets a
+# single call through: its success closes the circuit, a failure opens it again.
+# Cancelled calls say nothing about the gateway and leave the circuit as it is
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ):
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._set_state(CircuitState.CLOSED)
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        probe = self._admit()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            if is_gateway_failure(e):
+                self._record_failure()
+            else:
+                self._record_success()
+            raise
+        else:
+            self._record_success()
+        finally:
+            # only the call that was let through as the probe frees the slot
+            if probe:
+                self._probing = False
+
+    # Whether the call is the single one let through while half-open
+    def _admit(self) -> bool:
+        if self._state == CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self._reset_timeout:
+                self._reject()
+            self._set_state(CircuitState.HALF_OPEN)
+
+        if self._state == CircuitState.HALF_OPEN:
+            if self._probing:
+                self._reject()
+            self._probing = True
+            return True
+        return False
+
+    def _record_success(self):
+        self._failures = 0
+        if self._state != CircuitState.CLOSED:
+            self._set_state(CircuitState.CLOSED)
+
+    def _record_failure(self):
+        self._failures += 1
+        if (
+            self._state == CircuitState.HALF_OPEN
+            or self._failures >= self._failure_threshold
+        ):
+            self._opened_at = time.monotonic()
+            self._set_state(CircuitState.OPEN)
+
+    def _reject(self):
+        GATEWAY_CIRCUIT_REJECTED.labels(endpoint=self._name).inc()
+        raise CircuitOpen(self._name)
+
+    def _set_state(self, state: CircuitState):
+        self._state = state
+        GATEWAY_CIRCUIT_STATE.labels(endpoint=self._name).set(state)
@@ -0,0 +1,133 @@
+from typing import AsyncIterator, Dict, Optional
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import HTTPException
+from app.gateway.breaker import (
+    CircuitBreaker,
+    CircuitOpen,
+    DEFAULT_FAILURE_THRESHOLD,
+    DEFAULT_RESET_TIMEOUT,
+)
+import importlib.util
+import asyncio
+import random
+import httpx
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF_BASE = 0.1
+RETRY_BACKOFF_MAX = 2.0
+
+# Only these are retried, a failed write may still have been applied
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+def http2_available() -> bool:
+    # httpx only negotiates HTTP/2 when the optional `h2` package is installed
+    return importlib.util.find_spec("h2") is not None
+
+
+class GatewayClient:
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        retries: int = DEFAULT_RETRIES,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self._retries = retries
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._client = httpx.AsyncClient(
+            base_url=url,
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2_available(),
+            transport=transport,
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    # Each endpoint gets its own circuit breaker. `route` names the endpoint
+    # when the path has ids in it, e.g. `/users/{uuid}`, so they all share one
+    def _breaker(self, method: str, route: str) -> CircuitBreaker:
+        name = f"{method} {route}"
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self._failure_threshold, self._reset_timeout)
+            self._breakers[name] = breaker
+        return breaker
+
+    async def request(
+        self, method: str, endpoint: str, route: Optional[str] = None, **kwargs
+    ) -> httpx.Response:
+        breaker = self._breaker(method, route or endpoint)
+        attempts = 1 + (self._retries if method in IDEMPOTENT_METHODS else 0)
+
+        with map_gateway_errors():
+            for attempt in range(attempts):
+                if attempt:
+                    await asyncio.sleep(backoff(attempt))
+                try:
+                    with breaker.call():
+                        res = await self._client.request(method, endpoint, **kwargs)
+                        res.raise_for_status()
+                        return res
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if attempt + 1 == attempts or not is_retryable(e):
+                        raise
+
+    # Like `request`, but the body is left unread so it can be consumed in
+    # chunks with `aiter_bytes` while the context is open. Never retried
+    @asynccontextmanager
+    async def stream(
+        self, method: str, endpoint: str, route: Optional[str] = None, **kwargs
+    ) -> AsyncIterator[httpx.Response]:
+        with map_gateway_errors():
+            with self._breaker(method, route or endpoint).call():
+                async with self._client.stream(method, endpoint, **kwargs) as res:
+                    res.raise_for_status()
+                    yield res
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(e, httpx.TransportError)
+
+
+# Exponential backoff with full jitter, so retries from many requests don't
+# all land on the gateway at the same time
+def backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**attempt))
+
+
+@contextmanager
+def map_gateway_errors():
+    try:
+        yield
+    except CircuitOpen:
+        raise HTTPException(status_code=503, detail="Gateway is unavailable")
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(
+            status_code=e.response.status_code, detail=e.response.reason_phrase
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Gateway timed out")
+    except httpx.RequestError:
+        raise HTTPException(status_code=502, detail="Couldn't reach the gateway")
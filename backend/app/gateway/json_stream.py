@@ -0,0 +1,97 @@
+import re
+
+_TOKENS = re.compile(rb'[\[\]{}",]')
+_STRING_TOKENS = re.compile(rb'["\\]')
+_WHITESPACE = b" \t\r\n"
+
+
+# Incremental splitter for a top-level JSON array. Chunks of the body are fed
+# as they arrive and the raw bytes of every complete element are returned, so
+# only the element being read is ever buffered. Elements are not decoded here.
+class JSONArrayItems:
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self._item_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._done = False
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        if self._done:
+            if chunk.strip(_WHITESPACE):
+                raise ValueError("Unexpected data after the JSON array")
+            return []
+
+        buf = self._buf
+        buf += chunk
+        items = []
+        pos = self._pos
+
+        while pos < len(buf):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    pos += 1
+                    continue
+
+                match = _STRING_TOKENS.search(buf, pos)
+                if not match:
+                    pos = len(buf)
+                    break
+
+                pos = match.end()
+                if buf[match.start()] == ord("\\"):
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                continue
+
+            match = _TOKENS.search(buf, pos)
+            if not match:
+                pos = len(buf)
+                break
+
+            token = buf[match.start()]
+            if self._depth == 0:
+                if token != ord("[") or buf[: match.start()].strip(_WHITESPACE):
+                    raise ValueError("Expected a JSON array")
+                self._item_start = match.end()
+            pos = match.end()
+
+            if token == ord('"'):
+                self._in_string = True
+            elif token in b"[{":
+                self._depth += 1
+            elif token in b"]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(buf, match.start(), items)
+                    self._done = True
+                    if buf[pos:].strip(_WHITESPACE):
+                        raise ValueError("Unexpected data after the JSON array")
+                    pos = len(buf)
+                    break
+            elif self._depth == 1:  # a top-level comma
+                item = self._emit(buf, match.start(), items)
+                if not item:
+                    raise ValueError("Empty element in JSON array")
+                self._item_start = pos
+
+        # drop everything before the element currently being read
+        consumed = self._item_start if not self._done else len(buf)
+        del buf[:consumed]
+        self._pos = pos - consumed
+        self._item_start -= consumed
+        return items
+
+    def close(self):
+        if not self._done:
+            raise ValueError("Truncated JSON array")
+
+    def _emit(self, buf: bytearray, end: int, items: list[bytes]) -> bytes:
+        item = bytes(buf[self._item_start : end].strip(_WHITESPACE))
+        if item:
+            items.append(item)
+        return item
@@ -0,0 +1,84 @@
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import logging
+import queue
+import json
+
+# httpx logs a line for every request it sends, which drowns the app's own
+# logs during bulk operations
+DEFAULT_LEVELS = {"httpx": "WARNING", "httpcore": "WARNING"}
+
+TEXT_FORMAT = "%(levelname)s %(asctime)s %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Set by RequestContextMiddleware for the duration of each request
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        record.levelname = f"{record.levelname}:".ljust(9)
+        return super().format(record)
+
+
+# Tracebacks are already part of the message by the time records get here
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("request_id", "route", "latency_ms"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry)
+
+
+# Context variables aren't visible from the listener thread, so the request
+# fields are copied into the record before it's queued
+class RequestContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        scope = request_scope.get()
+        route = scope.get("route") if scope else None
+        record.route = route.path if route else None
+        return True
+
+
+# Records are put in a queue and written to stderr from a background thread,
+# so logging never blocks the event loop on I/O. `levels` sets the level of
+# single loggers on top of DEFAULT_LEVELS, as in
+# "app.services.admin=DEBUG,httpx=INFO"
+def initialize_log(
+    level: str = "INFO", json_output: bool = False, levels: str = ""
+) -> QueueListener:
+    handler = logging.StreamHandler()
+    formatter = (
+        JSONFormatter() if json_output else TextFormatter(TEXT_FORMAT, DATE_FORMAT)
+    )
+    handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    # the message is merged with its args before queueing, the rest of the
+    # formatting is left to the listener's handler
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    queue_handler.addFilter(RequestContextFilter())
+    logging.basicConfig(level=level.upper(), handlers=[queue_handler], force=True)
+
+    logger_levels = dict(DEFAULT_LEVELS)
+    for name, _, logger_level in (
+        entry.partition("=") for entry in levels.split(",") if entry.strip()
+    ):
+        logger_levels[name.strip()] = logger_level.strip().upper()
+    for name, logger_level in logger_levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener = QueueListener(records, handler)
+    listener.start()
+    return listener
@@ -1,41 +1,43 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.databases.mongo import MongoDB
+from app.gateway.client import GatewayClient, DEFAULT_RETRIES
+from app.gateway.breaker import DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT
 from app.services.admin import AdminService
+from app.services.hasher import (
+    PasswordHasher,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_QUEUE_TIMEOUT,
+)
+from app.services.bulk import BULK_CONCURRENCY
+from app.services.cache import DEFAULT_TTL, DEFAULT_MAX_STALE
+from app.services.token_cache import DEFAULT_TOKEN_CACHE_SIZE
 from app.controllers.admin import AdminController
-from app.routers.admin import AdminRouter
-from app.controllers.metrics import REQUEST_COUNT, REQUEST_LATENCY
+from app.routers.admin import AdminRouter, NEXT_CURSOR_HEADER
+from app.controllers.metrics import mark_process_dead
+from app.middlewares.metrics import MetricsMiddleware, DEFAULT_MAX_SERIES
+from app.middlewares.request_context import RequestContextMiddleware, REQUEST_ID_HEADER
+from app.log import initialize_log
 import logging
 import os
-import time
 
 DEFAULT_SECRET = "secret"
 
-
-def initialize_log(logging_level):
-    class CustomFormatter(logging.Formatter):
-        def format(self, record):
-            record.levelname = f"{record.levelname}:".ljust(9)
-            return super().format(record)
-
-    handler = logging.StreamHandler()
-    handler.setFormatter(
-        CustomFormatter(
-            fmt="%(levelname)s %(asctime)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-        )
-    )
-
-    logging.basicConfig(level=logging_level, handlers=[handler])
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    initialize_log(logging.INFO)
+    log_listener = initialize_log(
+        os.getenv("LOG_LEVEL", "INFO"),
+        json_output=os.getenv("LOG_FORMAT", "text") == "json",
+        levels=os.getenv("LOG_LEVELS", ""),
+    )
 
     JWT_SECRET = os.getenv("JWT_SECRET")
     if not JWT_SECRET:
-        logging.warning(f"JWT_SECRET was not defined, using default `{DEFAULT_SECRET}`")
+        logger.warning("JWT_SECRET was not defined, using default `%s`", DEFAULT_SECRET)
         JWT_SECRET = DEFAULT_SECRET
 
     DB_URI = os.getenv("DB_URI")
@@ -59,41 +61,62 @@ async def lifespan(app: FastAPI):
     except:
         raise RuntimeError("couldn't connect to db")
 
-    service = AdminService(db, GATEWAY_TOKEN, GATEWAY_URL, JWT_SECRET)
+    hasher = PasswordHasher(
+        workers=int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None,
+        queue_size=int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+        queue_timeout=float(
+            os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        ),
+        use_processes=os.getenv("PASSWORD_HASH_EXECUTOR", "thread") == "process",
+    )
+
+    gateway = GatewayClient(
+        GATEWAY_URL,
+        GATEWAY_TOKEN,
+        retries=int(os.getenv("GATEWAY_RETRIES", DEFAULT_RETRIES)),
+        failure_threshold=int(
+            os.getenv("GATEWAY_BREAKER_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)
+        ),
+        reset_timeout=float(os.getenv("GATEWAY_BREAKER_RESET", DEFAULT_RESET_TIMEOUT)),
+    )
+    service = AdminService(
+        db,
+        gateway,
+        JWT_SECRET,
+        hasher,
+        bulk_concurrency=int(os.getenv("GATEWAY_BULK_CONCURRENCY", BULK_CONCURRENCY)),
+        cache_ttl=float(os.getenv("GATEWAY_CACHE_TTL", DEFAULT_TTL)),
+        cache_max_stale=float(os.getenv("GATEWAY_CACHE_MAX_STALE", DEFAULT_MAX_STALE)),
+    )
+    await service.ensure_indexes()
     controller = AdminController(service)
-    admin_router = AdminRouter(controller, JWT_SECRET)
+    admin_router = AdminRouter(
+        controller,
+        JWT_SECRET,
+        token_cache_size=int(
+            os.getenv("AUTH_TOKEN_CACHE_SIZE", DEFAULT_TOKEN_CACHE_SIZE)
+        ),
+        fast_json=os.getenv("FAST_JSON_RESPONSES", "false") == "true",
+    )
     app.include_router(admin_router.router)
 
     yield
 
+    await gateway.close()
+    hasher.close()
     db.close()
+    mark_process_dead(os.getpid())
+    log_listener.stop()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-@app.middleware("http")
-async def prometheus_middleware(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-
-    route = request.scope.get("route")
-    route = route.path if route else request.url.path
-
-    # Update metrics
-    REQUEST_COUNT.labels(
-        method=request.method,
-        route=route,
-        status=response.status_code,
-    ).inc()
-
-    REQUEST_LATENCY.labels(method=request.method, route=route).observe(
-        process_time,
-    )
-
-    return response
-
+app.add_middleware(
+    MetricsMiddleware,
+    max_series=int(os.getenv("HTTP_METRICS_MAX_SERIES", DEFAULT_MAX_SERIES)),
+)
+app.add_middleware(RequestContextMiddleware)
 
 # Enable CORS
 app.add_middleware(
@@ -102,4 +125,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, REQUEST_ID_HEADER],
 )
@@ -0,0 +1,80 @@
+from typing import Dict, Tuple
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.controllers.metrics import (
+    REQUEST_COUNT,
+    REQUEST_LATENCY,
+    RESPONSE_SIZE,
+    DROPPED_SERIES,
+)
+import time
+
+DEFAULT_MAX_SERIES = 1000
+
+# Label values used instead of the ones a client controls, so random paths or
+# methods can't create new series
+UNMATCHED_ROUTE = "<unmatched>"
+OVERFLOW_ROUTE = "<overflow>"
+OTHER_METHOD = "OTHER"
+KNOWN_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+# Plain ASGI middleware, so requests aren't wrapped in the extra task and
+# streams that `@app.middleware("http")` adds. Metrics are recorded once the
+# last chunk of the body was sent, which also makes streamed responses count
+# their full duration and size. Once `max_series` label combinations exist,
+# requests for new ones are recorded under OVERFLOW_ROUTE
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, max_series: int = DEFAULT_MAX_SERIES):
+        self.app = app
+        self._max_series = max_series
+        self._metrics: Dict[Tuple[str, str, int], tuple] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+        size = 0
+
+        async def send_with_metrics(message: Message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            route = scope.get("route")
+            route = route.path if route else UNMATCHED_ROUTE
+            method = scope["method"]
+            if method not in KNOWN_METHODS:
+                method = OTHER_METHOD
+            count, latency, response_size = self._labelled(method, route, status_code)
+            count.inc()
+            latency.observe(time.perf_counter() - start)
+            response_size.observe(size)
+
+    # Looking up the children by labels takes a lock and builds a tuple of
+    # strings on every call, so they are kept once created
+    def _labelled(self, method: str, route: str, status_code: int) -> tuple:
+        key = (method, route, status_code)
+        metrics = self._metrics.get(key)
+        if metrics is None and len(self._metrics) >= self._max_series:
+            DROPPED_SERIES.inc()
+            key = (method, OVERFLOW_ROUTE, status_code)
+            metrics = self._metrics.get(key)
+            route = OVERFLOW_ROUTE
+
+        if metrics is None:
+            metrics = (
+                REQUEST_COUNT.labels(method=method, route=route, status=status_code),
+                REQUEST_LATENCY.labels(method=method, route=route),
+                RESPONSE_SIZE.labels(method=method, route=route),
+            )
+            self._metrics[key] = metrics
+        return metrics
@@ -0,0 +1,63 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.log import request_id, request_scope
+import logging
+import time
+import uuid
+import re
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Ids sent by callers that don't look like this are replaced by a new one
+VALID_REQUEST_ID = re.compile(rb"[A-Za-z0-9._:-]{1,64}")
+
+logger = logging.getLogger("app.access")
+
+
+# Gives every request an id, taken from the X-Request-ID header when the
+# caller sent one, that is added to its log records and to the response.
+# Logs a line with the latency of each request once it's done
+class RequestContextMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        sent = next((value for key, value in scope["headers"] if key == header), b"")
+        if VALID_REQUEST_ID.fullmatch(sent):
+            rid = sent.decode("ascii")
+        else:
+            rid = uuid.uuid4().hex
+        id_token = request_id.set(rid)
+        scope_token = request_scope.set(scope)
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((header, rid.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            if logger.isEnabledFor(logging.INFO):
+                latency = (time.perf_counter() - start) * 1000
+                logger.info(
+                    "%s %s %d %.1fms",
+                    scope["method"],
+                    scope["path"],
+                    status_code,
+                    latency,
+                    extra={"latency_ms": round(latency, 3)},
+                )
+            request_id.reset(id_token)
+            request_scope.reset(scope_token)
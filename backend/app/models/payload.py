@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+
+
+# An already serialized JSON response along with its strong ETag
+class CachedPayload(BaseModel):
+    body: bytes
+    etag: str
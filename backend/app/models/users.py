@@ -1,5 +1,7 @@
-from typing import List
-from pydantic import BaseModel, EmailStr
+from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
+
+MAX_BULK_SIZE = 1000
 
 
 class Course(BaseModel):
@@ -29,3 +31,35 @@ class UserOut(BaseModel):
     description: str
     createdAt: str
     accountLockedByAdmins: bool
+
+
+class UserWithEnrollments(UserOut):
+    enrollments: List[Enrollment]
+
+
+class EnrollmentRoleChange(BaseModel):
+    courseId: str
+    uuid: str
+    role: str
+
+
+class BulkEnrollmentUpdate(BaseModel):
+    updates: List[EnrollmentRoleChange] = Field(
+        ..., min_length=1, max_length=MAX_BULK_SIZE
+    )
+
+
+class EnrollmentUpdateResult(EnrollmentRoleChange):
+    status_code: int
+    detail: Optional[str] = None
+
+
+class BulkLockStatusUpdate(BaseModel):
+    uuids: List[str] = Field(..., min_length=1, max_length=MAX_BULK_SIZE)
+    locked: bool
+
+
+class LockStatusResult(BaseModel):
+    uuid: str
+    status_code: int
+    detail: Optional[str] = None
@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Annotated, AsyncIterator, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.controllers.admin import AdminController
 from app.controllers.metrics import MetricsController
@@ -12,16 +15,97 @@ from app.models.admin import (
     RuleOut,
     RuleUpdateWithAdminName,
 )
-from app.models.users import UserOut, Enrollment, EnrollmentUpdate
+from app.models.users import (
+    UserOut,
+    Enrollment,
+    EnrollmentUpdate,
+    UserWithEnrollments,
+    BulkLockStatusUpdate,
+    LockStatusResult,
+    BulkEnrollmentUpdate,
+    EnrollmentUpdateResult,
+)
+from app.models.page import Page
+from app.models.payload import CachedPayload
+from app.services.pagination import MAX_PAGE_SIZE
+from app.services.token_cache import VerifiedTokenCache, DEFAULT_TOKEN_CACHE_SIZE
 import logging
 import jwt
 
 security = HTTPBearer(auto_error=False)
 ALGORITHM = "HS256"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+Limit = Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)]
+
+logger = logging.getLogger(__name__)
+
+admins_adapter = TypeAdapter(list[AdminOut])
+users_adapter = TypeAdapter(list[UserOut])
+users_with_enrollments_adapter = TypeAdapter(list[UserWithEnrollments])
+enrollments_adapter = TypeAdapter(list[Enrollment])
+rules_adapter = TypeAdapter(list[RuleOut])
+
+
+def with_next_cursor(response: Response, page: Page) -> list:
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+
+# Serializes one model per line, grouping lines into chunks of around
+# STREAM_CHUNK_SIZE bytes so big lists aren't sent a few hundred bytes at a time
+async def ndjson_lines(items: AsyncIterator[BaseModel]) -> AsyncIterator[bytes]:
+    chunk = bytearray()
+    async for item in items:
+        chunk += item.model_dump_json().encode()
+        chunk += b"\n"
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+
+    if chunk:
+        yield bytes(chunk)
+
 
+# Serializes the models straight to bytes. Returning them instead would make
+# FastAPI validate the whole list again against `response_model` first
+def fast_json_response(adapter: TypeAdapter, items: list) -> Response:
+    return Response(content=adapter.dump_json(items), media_type="application/json")
 
-def validate_token_with_secret_key(secret_key: str):
-    def validate_token(
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+# Clients are told to always revalidate, which costs them nothing as long as
+# their ETag still matches
+def cached_json_response(
+    payload: CachedPayload, if_none_match: Optional[str]
+) -> Response:
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, payload.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(
+        content=payload.body, media_type="application/json", headers=headers
+    )
+
+
+def validate_token_with_secret_key(
+    secret_key: str, cache_size: int = DEFAULT_TOKEN_CACHE_SIZE
+):
+    verified_tokens = VerifiedTokenCache(cache_size)
+
+    # async so it runs on the event loop instead of being sent to a thread
+    async def validate_token(
         credentials: HTTPAuthorizationCredentials = Depends(security),
     ):
         if not credentials:
@@ -30,9 +114,15 @@ def validate_token_with_secret_key(secret_key: str):
                 detail="No authentication credentials were provided",
             )
 
+        token = credentials.credentials
+        claims = verified_tokens.get(token)
+        if claims is not None:
+            return claims
+
         try:
-            token = credentials.credentials
-            return jwt.decode(token, secret_key, algorithms=[ALGORITHM])
+            claims = jwt.decode(token, secret_key, algorithms=[ALGORITHM])
+            verified_tokens.put(token, claims)
+            return claims
         except jwt.PyJWTError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -43,8 +133,15 @@ def validate_token_with_secret_key(secret_key: str):
 
 
 class AdminRouter:
-    def __init__(self, controller: AdminController, secret_key: str):
+    def __init__(
+        self,
+        controller: AdminController,
+        secret_key: str,
+        token_cache_size: int = DEFAULT_TOKEN_CACHE_SIZE,
+        fast_json: bool = False,
+    ):
         self._controller = controller
+        self._fast_json = fast_json
         self._metrics_controller = MetricsController()
         self.router = APIRouter(prefix="/admins", tags=["admins"])
 
@@ -54,13 +151,20 @@ class AdminRouter:
         self.router.get("/rules", response_model=list[RuleOut])(self.get_all_rules)
 
         # Protected
-        dependencies = [Depends(validate_token_with_secret_key(secret_key))]
+        validate_token = validate_token_with_secret_key(secret_key, token_cache_size)
+        dependencies = [Depends(validate_token)]
         self.router.get(
             "/users",
             response_model=list[UserOut],
             dependencies=dependencies,
         )(self.get_all_users)
 
+        self.router.get(
+            "/users/with-enrollments",
+            response_model=list[UserWithEnrollments],
+            dependencies=dependencies,
+        )(self.get_all_users_with_enrollments)
+
         self.router.get(
             "",
             response_model=list[AdminOut],
@@ -99,11 +203,23 @@ class AdminRouter:
             dependencies=dependencies,
         )(self.delete_admin)
 
+        self.router.patch(
+            "/users/lock-status",
+            response_model=list[LockStatusResult],
+            dependencies=dependencies,
+        )(self.update_users_lock_status)
+
         self.router.patch(
             "/users/{uuid}/lock-status",
             dependencies=dependencies,
         )(self.update_user_lock_status)
 
+        self.router.patch(
+            "/courses/enrollments",
+            response_model=list[EnrollmentUpdateResult],
+            dependencies=dependencies,
+        )(self.update_users_enrollment)
+
         self.router.patch(
             "/courses/{courseId}/enrollments/{uuid}",
             dependencies=dependencies,
@@ -126,68 +242,116 @@ class AdminRouter:
             dependencies=dependencies,
         )(self.update_rule)
 
+    # `items` is either a list or a Page, whose cursor goes in a header
+    def _list_response(self, response: Optional[Response], adapter: TypeAdapter, items):
+        page = items if isinstance(items, Page) else None
+        if page is not None:
+            items = page.items
+        if self._fast_json:
+            response = fast_json_response(adapter, items)
+        if page is not None:
+            with_next_cursor(response, page)
+        return response if self._fast_json else items
+
     async def login(self, login_data: AdminLogin):
-        logging.info(f"Trying to login for admin {login_data.email}")
+        logger.info("Trying to login for admin %s", login_data.email)
         return await self._controller.login(login_data)
 
     async def create_admin(self, admin: AdminCreate):
-        logging.info(f"Trying to create an admin {admin.email}")
+        logger.info("Trying to create an admin %s", admin.email)
         return await self._controller.create_admin(admin)
 
     async def get_admin(self, id: str):
-        logging.info(f"Trying to get an admin {id}")
+        logger.info("Trying to get an admin %s", id)
         return await self._controller.get_admin(id)
 
-    async def get_all_admins(self):
-        logging.info(f"Trying to get all admins")
-        return await self._controller.get_all_admins()
+    async def get_all_admins(
+        self, response: Response, limit: Limit = None, after: Optional[str] = None
+    ):
+        logger.info("Trying to get all admins")
+        page = await self._controller.get_all_admins(limit, after)
+        return self._list_response(response, admins_adapter, page)
 
     async def delete_admin(self, id: str):
-        logging.info(f"Trying to delete an admin {id}")
+        logger.info("Trying to delete an admin %s", id)
         return await self._controller.delete_admin(id)
 
-    async def get_all_users(self):
-        logging.info(f"Trying to get all the users")
-        return await self._controller.get_all_users()
+    async def get_all_users(self, accept: Annotated[Optional[str], Header()] = None):
+        if accept and NDJSON_MEDIA_TYPE in accept:
+            logger.info("Trying to stream all the users")
+            users = await self._controller.stream_all_users()
+            return StreamingResponse(ndjson_lines(users), media_type=NDJSON_MEDIA_TYPE)
+
+        logger.info("Trying to get all the users")
+        users = await self._controller.get_all_users()
+        return self._list_response(None, users_adapter, users)
+
+    async def get_all_users_with_enrollments(self):
+        logger.info("Trying to get all the users with their enrollments")
+        users = await self._controller.get_all_users_with_enrollments()
+        return self._list_response(None, users_with_enrollments_adapter, users)
 
     async def get_all_users_enrollment(self):
-        logging.info(f"Trying to get all user enrollments")
-        return await self._controller.get_all_users_enrollment()
+        logger.info("Trying to get all user enrollments")
+        enrollments = await self._controller.get_all_users_enrollment()
+        return self._list_response(None, enrollments_adapter, enrollments)
 
     async def update_user_lock_status(self, uuid: str, payload: LockStatusUpdate):
         status = "locked" if payload.locked else "unlocked"
-        logging.info(f"Trying to update user status for user {uuid} to {status}")
+        logger.info("Trying to update user status for user %s to %s", uuid, status)
         return await self._controller.update_user_lock_status(uuid, payload.locked)
 
+    async def update_users_lock_status(self, payload: BulkLockStatusUpdate):
+        status = "locked" if payload.locked else "unlocked"
+        logger.info("Trying to update %s users to %s", len(payload.uuids), status)
+        return await self._controller.update_users_lock_status(
+            payload.uuids, payload.locked
+        )
+
     async def update_user_enrollment(
         self, courseId: str, uuid: str, enrollmentData: EnrollmentUpdate
     ):
-        logging.info(f"Trying to update user enrollment for user {uuid}")
+        logger.info("Trying to update user enrollment for user %s", uuid)
         return await self._controller.update_user_enrollment(
             uuid, courseId, enrollmentData
         )
 
+    async def update_users_enrollment(self, payload: BulkEnrollmentUpdate):
+        logger.info("Trying to update %s user enrollments", len(payload.updates))
+        return await self._controller.update_users_enrollment(payload.updates)
+
     async def get_metrics(self):
         return self._metrics_controller.get_metrics()
 
     async def create_rule(self, rule: RuleCreate):
-        logging.info(f"Trying to create a new rule with title {rule.title}")
+        logger.info("Trying to create a new rule with title %s", rule.title)
         return await self._controller.create_rule(rule)
 
-    async def get_all_rules(self):
-        logging.info("Trying to get all rules")
-        return await self._controller.get_all_rules()
+    async def get_all_rules(
+        self,
+        response: Response,
+        limit: Limit = None,
+        after: Optional[str] = None,
+        if_none_match: Annotated[Optional[str], Header()] = None,
+    ):
+        logger.info("Trying to get all rules")
+        if limit is None and after is None:
+            payload = await self._controller.get_all_rules_payload()
+            return cached_json_response(payload, if_none_match)
+
+        page = await self._controller.get_all_rules(limit, after)
+        return self._list_response(response, rules_adapter, page)
 
     async def update_rule(self, id: str, update: RuleUpdateWithAdminName):
         admin_name = update.admin_name
         rule_update = update.update
-        logging.info(f"Trying to update rule with id: {id}, by {admin_name}")
+        logger.info("Trying to update rule with id: %s, by %s", id, admin_name)
         return await self._controller.update_rule(id, admin_name, rule_update)
 
     async def get_rule(self, id: str):
-        logging.info(f"Trying to get rule with id: {id}")
+        logger.info("Trying to get rule with id: %s", id)
         return await self._controller.get_rule(id)
 
     async def notify_rules(self):
-        logging.info(f"Trying to notify rules")
+        logger.info("Trying to notify rules")
         return await self._controller.notify_rules()
@@ -1,12 +1,35 @@
-from typing import Optional, override, Callable
+from typing import AsyncIterator, Optional, override
 from app.databases.db import DB
+from app.gateway.client import GatewayClient
+from app.gateway.json_stream import JSONArrayItems
 from app.exceptions.username_or_email import UsernameEmailInUser
 from app.exceptions.rule_title_in_use import TitleAlreadyInUse
-from app.models.users import UserOut, EnrollmentUsers, Enrollment, EnrollmentUpdate
+from app.exceptions.duplicate_key import DuplicateKey
+from app.models.users import (
+    UserOut,
+    EnrollmentUsers,
+    Enrollment,
+    EnrollmentUpdate,
+    LockStatusResult,
+    EnrollmentRoleChange,
+    EnrollmentUpdateResult,
+)
 from app.services.service import Service
+from app.services.hasher import PasswordHasher
+from app.services.bulk import run_bounded, bulk_status, BULK_CONCURRENCY
+from app.services.cache import (
+    StaleWhileRevalidate,
+    SingleFlight,
+    DEFAULT_TTL,
+    DEFAULT_MAX_STALE,
+)
+from app.services.pagination import decode_cursor, page_limit, build_page
+from app.models.page import Page
+from app.models.payload import CachedPayload
 from fastapi import HTTPException
 from datetime import datetime, timedelta
-from requests import HTTPError, Response
+from httpx import Response
+from pydantic import TypeAdapter
 from app.models.admin import (
     AdminCreate,
     AdminOut,
@@ -17,62 +40,129 @@ from app.models.admin import (
     RuleUpdate,
     RulePacket,
 )
-import bcrypt
+import hashlib
 import jwt
-import requests
 import logging
+import time
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+RULES_CACHE_TTL = 30.0
+
+logger = logging.getLogger(__name__)
+
+# Only what's returned is read, so password hashes never leave the database
+ADMIN_FIELDS = list(AdminOut.model_fields)
+
+rules_adapter = TypeAdapter(list[RuleOut])
+users_adapter = TypeAdapter(list[UserOut])
+enrollment_users_adapter = TypeAdapter(EnrollmentUsers)
+
+
+def etag_for(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+# Cache patches mirroring the changes we make through the gateway
+def set_lock_status(uuids: set[str], locked: bool):
+    def patch(users: list[UserOut]):
+        for user in users:
+            if user.uuid in uuids:
+                user.accountLockedByAdmins = locked
+
+    return patch
+
+
+# `roles` maps (courseId, uuid) to the new role
+def set_roles(roles: dict[tuple[str, str], str]):
+    def patch(enrollments: list[Enrollment]):
+        for enrollment in enrollments:
+            role = roles.get((str(enrollment.course.id), enrollment.userId))
+            if role is not None:
+                enrollment.role = role
+
+    return patch
 
 
 class AdminService(Service):
-    def __init__(self, db: DB, gateway_token: str, gateway_url: str, jwt_secret: str):
+    def __init__(
+        self,
+        db: DB,
+        gateway: GatewayClient,
+        jwt_secret: str,
+        hasher: Optional[PasswordHasher] = None,
+        rules_cache_ttl: float = RULES_CACHE_TTL,
+        bulk_concurrency: int = BULK_CONCURRENCY,
+        cache_ttl: float = DEFAULT_TTL,
+        cache_max_stale: float = DEFAULT_MAX_STALE,
+    ):
         self._db = db
         self._admin_coll = "admins"
         self._rule_coll = "rules"
-        self._gateway_token = gateway_token
-        self._gateway_url = gateway_url
+        self._gateway = gateway
         self._secret = jwt_secret
+        self._hasher = hasher or PasswordHasher()
+        self._bulk_concurrency = bulk_concurrency
 
-    def hash_password(self, password: str) -> str:
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode(), salt)
-        return hashed.decode()
+        self._gateway_reads = SingleFlight()
 
-    @override
-    async def create_admin(self, data: AdminCreate) -> AdminOut:
-        existing = await self._db.exists_with_username_email(
-            self._admin_coll, data.username, data.email
+        # Several admins loading the dashboard at once get the same lists from
+        # the gateway, so they are shared for a while
+        self._users_cache = StaleWhileRevalidate(
+            self._fetch_all_users, cache_ttl, cache_max_stale
+        )
+        self._enrollments_cache = StaleWhileRevalidate(
+            self._fetch_all_users_enrollment, cache_ttl, cache_max_stale
         )
-        if existing:
-            raise UsernameEmailInUser()
 
-        hashed_password = self.hash_password(data.password)
+        # Rules are read far more often than they change, so the serialized
+        # list is kept until a rule is created or updated. The TTL only bounds
+        # how long other worker processes keep serving a list changed elsewhere
+        self._rules_cache_ttl = rules_cache_ttl
+        self._rules_payload: Optional[CachedPayload] = None
+        self._rules_payload_expiry = 0.0
+        self._rules_version = 0
+
+    async def hash_password(self, password: str) -> str:
+        return await self._hasher.hash(password)
+
+    # Uniqueness is enforced by the db, so creates can insert right away and
+    # rely on DuplicateKey instead of checking first
+    async def ensure_indexes(self):
+        await self._db.create_index(self._admin_coll, "email", unique=True)
+        await self._db.create_index(self._admin_coll, "username", unique=True)
+        await self._db.create_index(self._rule_coll, "title", unique=True)
+
+    @override
+    async def create_admin(self, data: AdminCreate) -> AdminOut:
+        hashed_password = await self.hash_password(data.password)
         admin_dict = data.model_dump()
         admin_dict["password"] = hashed_password
         admin_dict["registration_date"] = datetime.utcnow().isoformat() + "Z"
 
-        admin = await self._db.create(self._admin_coll, admin_dict)
+        try:
+            admin = await self._db.create(self._admin_coll, admin_dict)
+        except DuplicateKey:
+            raise UsernameEmailInUser()
         return AdminOut(**admin)
 
     @override
     async def get_admin(self, id: str) -> Optional[AdminOut]:
-        admin = await self._db.find_one(self._admin_coll, id)
+        admin = await self._db.find_one(self._admin_coll, id, ADMIN_FIELDS)
         return AdminOut(**admin) if admin else None
 
     @override
-    async def get_all_admins(self) -> list[AdminOut]:
-        return [
-            AdminOut(**admin) for admin in (await self._db.get_all(self._admin_coll))
-        ]
+    async def get_all_admins(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[AdminOut]:
+        return await self._get_page(self._admin_coll, AdminOut, limit, after)
 
     @override
     async def delete_admin(self, id: str):
         return await self._db.delete(self._admin_coll, id)
 
-    def verify_password(self, plain: str, hashed: str) -> bool:
-        return bcrypt.checkpw(plain.encode(), hashed.encode())
+    async def verify_password(self, plain: str, hashed: str) -> bool:
+        return await self._hasher.verify(plain, hashed)
 
     def create_token(self, data: dict) -> str:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -87,7 +177,7 @@ class AdminService(Service):
         if not admin:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        if not self.verify_password(credentials.password, admin["password"]):
+        if not await self.verify_password(credentials.password, admin["password"]):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
         token = self.create_token({"sub": str(admin["id"]), "email": admin["email"]})
@@ -95,17 +185,49 @@ class AdminService(Service):
 
     @override
     async def create_rule(self, data: RuleCreate) -> RuleOut:
-        existing = await self._db.exists_with_title(self._rule_coll, data.title)
-        if existing:
-            raise TitleAlreadyInUse()
-
         rule_dict = data.model_dump()
-        rule = await self._db.create(self._rule_coll, rule_dict)
+        try:
+            rule = await self._db.create(self._rule_coll, rule_dict)
+        except DuplicateKey:
+            raise TitleAlreadyInUse()
+        self._invalidate_rules()
         return RuleOut(**rule)
 
     @override
-    async def get_all_rules(self) -> list[RuleOut]:
-        return [RuleOut(**rule) for rule in (await self._db.get_all(self._rule_coll))]
+    async def get_all_rules(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[RuleOut]:
+        return await self._get_page(self._rule_coll, RuleOut, limit, after)
+
+    @override
+    async def get_all_rules_payload(self) -> CachedPayload:
+        if self._rules_payload and time.monotonic() < self._rules_payload_expiry:
+            return self._rules_payload
+
+        version = self._rules_version
+        rules = await self.get_all_rules()
+        body = rules_adapter.dump_json(rules.items)
+        payload = CachedPayload(body=body, etag=etag_for(body))
+
+        # a rule could have changed while reading them, don't cache that list
+        if version == self._rules_version:
+            self._rules_payload = payload
+            self._rules_payload_expiry = time.monotonic() + self._rules_cache_ttl
+
+        return payload
+
+    def _invalidate_rules(self):
+        self._rules_version += 1
+        self._rules_payload = None
+
+    async def _get_page(
+        self, collection: str, model, limit: Optional[int], after: Optional[str]
+    ) -> Page:
+        after_id = decode_cursor(after) if after else None
+        docs = await self._db.get_all(
+            collection, page_limit(limit), after_id, list(model.model_fields)
+        )
+        return build_page(docs, limit, model)
 
     @override
     async def get_rule(self, id: str) -> Optional[RuleOut]:
@@ -116,9 +238,16 @@ class AdminService(Service):
     async def update_rule(self, id: str, admin_name: str, data: RuleUpdate):
         rule_dict = data.model_dump(exclude_unset=True)
 
-        prev = await self._db.update(self._rule_coll, id, rule_dict)
+        try:
+            prev = await self._db.update(self._rule_coll, id, rule_dict)
+        except DuplicateKey:
+            raise TitleAlreadyInUse()
         if not prev:
             raise HTTPException(404, "The provided rule id doesn't exist")
+        self._invalidate_rules()
+
+        if not logger.isEnabledFor(logging.INFO):
+            return
 
         changes = []
         for field, new_value in rule_dict.items():
@@ -126,69 +255,143 @@ class AdminService(Service):
             changes.append(change)
 
         changes_fmt = "\n".join(changes)
-        logging.info(f"{admin_name} made changes to rule id: {id}:\n{changes_fmt}")
+        logger.info("%s made changes to rule id: %s:\n%s", admin_name, id, changes_fmt)
 
     async def _send_to_gateway_through_admin_backend(
-        self, method: Callable, endpoint: str, **kwargs
+        self, method: str, endpoint: str, route: Optional[str] = None, **kwargs
     ) -> Response:
         endpoint = f"/admin-backend{endpoint}"
-        return await self._send_to_gateway_directly(method, endpoint, **kwargs)
+        if route:
+            kwargs["route"] = f"/admin-backend{route}"
+        if method != "GET" or kwargs:
+            return await self._send_to_gateway_directly(method, endpoint, **kwargs)
+
+        # identical reads in flight at the same time share one gateway request
+        return await self._gateway_reads.do(
+            endpoint, lambda: self._send_to_gateway_directly(method, endpoint)
+        )
 
     @override
     async def get_all_users(self) -> list[UserOut]:
+        return await self._users_cache.get()
+
+    async def _fetch_all_users(self) -> list[UserOut]:
         endpoint = "/users"
-        res = await self._send_to_gateway_through_admin_backend(requests.get, endpoint)
-        return [UserOut(**user) for user in res.json()]
+        res = await self._send_to_gateway_through_admin_backend("GET", endpoint)
+        return users_adapter.validate_json(res.content)
+
+    @override
+    async def stream_all_users(self) -> AsyncIterator[UserOut]:
+        endpoint = "/admin-backend/users"
+        async with self._gateway.stream("GET", endpoint) as res:
+            items = JSONArrayItems()
+            async for chunk in res.aiter_bytes():
+                for user in items.feed(chunk):
+                    yield UserOut.model_validate_json(user)
+            items.close()
 
     @override
     async def get_all_users_enrollment(self) -> list[Enrollment]:
+        return await self._enrollments_cache.get()
+
+    async def _fetch_all_users_enrollment(self) -> list[Enrollment]:
         endpoint = "/courses/enrollments"
-        res = await self._send_to_gateway_through_admin_backend(requests.get, endpoint)
-        return EnrollmentUsers(**res.json()).data
+        res = await self._send_to_gateway_through_admin_backend("GET", endpoint)
+        return enrollment_users_adapter.validate_json(res.content).data
 
     @override
     async def update_user_lock_status(self, uuid: str, locked: bool):
+        await self._patch_lock_status(uuid, locked)
+        self._users_cache.patch(set_lock_status({uuid}, locked))
+        status = "locked" if locked else "unlocked"
+        logger.info("%s user %s", status, uuid)
+
+    @override
+    async def update_users_lock_status(
+        self, uuids: list[str], locked: bool
+    ) -> list[LockStatusResult]:
+        uuids = list(dict.fromkeys(uuids))
+        errors = await run_bounded(
+            uuids,
+            lambda uuid: self._patch_lock_status(uuid, locked),
+            self._bulk_concurrency,
+        )
+
+        locked_uuids = {uuid for uuid, error in zip(uuids, errors) if not error}
+        self._users_cache.patch(set_lock_status(locked_uuids, locked))
+
+        status = "locked" if locked else "unlocked"
+        failed = sum(1 for error in errors if error)
+        logger.info("%s %s users, %s failed", status, len(uuids) - failed, failed)
+        return [
+            LockStatusResult(uuid=uuid, **bulk_status(error))
+            for uuid, error in zip(uuids, errors)
+        ]
+
+    async def _patch_lock_status(self, uuid: str, locked: bool):
         endpoint = f"/users/{uuid}/lock-status"
+        route = "/users/{uuid}/lock-status"
         data = {"locked": locked}
         await self._send_to_gateway_through_admin_backend(
-            requests.patch, endpoint, json=data
+            "PATCH", endpoint, route=route, json=data
         )
-        status = "locked" if locked else "unlocked"
-        logging.info(f"{status} user {uuid}")
 
     @override
     async def update_user_enrollment(
         self, courseId: str, uuid: str, enrollmentData: EnrollmentUpdate
     ):
+        await self._patch_enrollment(courseId, uuid, enrollmentData.role)
+        self._enrollments_cache.patch(
+            set_roles({(courseId, uuid): enrollmentData.role})
+        )
+        logger.info(
+            "updated role for user %s to %s at course %s",
+            uuid,
+            enrollmentData.role,
+            courseId,
+        )
+
+    @override
+    async def update_users_enrollment(
+        self, updates: list[EnrollmentRoleChange]
+    ) -> list[EnrollmentUpdateResult]:
+        errors = await run_bounded(
+            updates,
+            lambda u: self._patch_enrollment(u.courseId, u.uuid, u.role),
+            self._bulk_concurrency,
+        )
+
+        roles = {
+            (update.courseId, update.uuid): update.role
+            for update, error in zip(updates, errors)
+            if not error
+        }
+        self._enrollments_cache.patch(set_roles(roles))
+
+        failed = sum(1 for error in errors if error)
+        logger.info("updated %s enrollments, %s failed", len(updates) - failed, failed)
+        return [
+            EnrollmentUpdateResult(**dict(update), **bulk_status(error))
+            for update, error in zip(updates, errors)
+        ]
+
+    async def _patch_enrollment(self, courseId: str, uuid: str, role: str):
         endpoint = f"/courses/{courseId}/enrollments/{uuid}"
-        data = {"role": enrollmentData.role}
+        route = "/courses/{courseId}/enrollments/{uuid}"
+        data = {"role": role}
         await self._send_to_gateway_through_admin_backend(
-            requests.patch, endpoint, json=data
-        )
-        logging.info(
-            f"updated role for user {uuid} to {enrollmentData.role} at course {courseId}"
+            "PATCH", endpoint, route=route, json=data
         )
 
     async def _send_to_gateway_directly(
-        self, method: Callable, endpoint: str, **kwargs
+        self, method: str, endpoint: str, **kwargs
     ) -> Response:
-        url = f"{self._gateway_url}{endpoint}"
-        headers = {"Authorization": f"Bearer {self._gateway_token}"}
-        try:
-            res: Response = method(
-                **{"url": url, "headers": headers, "timeout": 5, **kwargs}
-            )
-            res.raise_for_status()
-            return res
-        except HTTPError as e:
-            raise HTTPException(
-                status_code=e.response.status_code, detail=e.response.reason
-            )
+        return await self._gateway.request(method, endpoint, **kwargs)
 
     @override
     async def notify_rules(self):
         rules = await self.get_all_rules()
         endpoint = "/email/rules"
-        data = RulePacket(rules=rules).model_dump()
-        await self._send_to_gateway_directly(requests.post, endpoint, json=data)
-        logging.info("sent notification for rules")
+        data = RulePacket(rules=rules.items).model_dump()
+        await self._send_to_gateway_directly("POST", endpoint, json=data)
+        logger.info("sent notification for rules")
@@ -1,7 +1,17 @@
-from typing import Optional, override
-from app.models.users import UserOut, Enrollment, EnrollmentUpdate
+from typing import AsyncIterator, Optional, override
+from app.models.users import (
+    UserOut,
+    Enrollment,
+    EnrollmentUpdate,
+    LockStatusResult,
+    EnrollmentRoleChange,
+    EnrollmentUpdateResult,
+)
+from app.models.page import Page
+from app.models.payload import CachedPayload
 from app.services.service import Service
 from app.services.admin import AdminService
+from app.services.bulk import run_bounded, bulk_status
 from fastapi import HTTPException
 from collections import deque
 from app.models.admin import (
@@ -38,8 +48,10 @@ class AdminMockService(Service):
         return await self._inner.get_admin(id)
 
     @override
-    async def get_all_admins(self) -> list[AdminOut]:
-        return await self._inner.get_all_admins()
+    async def get_all_admins(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[AdminOut]:
+        return await self._inner.get_all_admins(limit, after)
 
     @override
     async def delete_admin(self, id: str):
@@ -53,6 +65,11 @@ class AdminMockService(Service):
     async def get_all_users(self) -> list[UserOut]:
         return list(self._users.values())
 
+    @override
+    async def stream_all_users(self) -> AsyncIterator[UserOut]:
+        for user in list(self._users.values()):
+            yield user
+
     @override
     async def get_all_users_enrollment(self) -> list[Enrollment]:
         return [
@@ -67,6 +84,18 @@ class AdminMockService(Service):
             raise HTTPException(404, "uuid was not found in users db")
         self._users[uuid].accountLockedByAdmins = locked
 
+    @override
+    async def update_users_lock_status(
+        self, uuids: list[str], locked: bool
+    ) -> list[LockStatusResult]:
+        errors = await run_bounded(
+            uuids, lambda uuid: self.update_user_lock_status(uuid, locked)
+        )
+        return [
+            LockStatusResult(uuid=uuid, **bulk_status(error))
+            for uuid, error in zip(uuids, errors)
+        ]
+
     @override
     async def update_user_enrollment(
         self, courseId: str, uuid: str, enrollmentData: EnrollmentUpdate
@@ -77,13 +106,34 @@ class AdminMockService(Service):
             raise HTTPException(404, "courseId not found in user's enrollments")
         self._enrollments[uuid][courseId].role = enrollmentData.role
 
+    @override
+    async def update_users_enrollment(
+        self, updates: list[EnrollmentRoleChange]
+    ) -> list[EnrollmentUpdateResult]:
+        errors = await run_bounded(
+            updates,
+            lambda u: self.update_user_enrollment(
+                u.courseId, u.uuid, EnrollmentUpdate(role=u.role)
+            ),
+        )
+        return [
+            EnrollmentUpdateResult(**dict(update), **bulk_status(error))
+            for update, error in zip(updates, errors)
+        ]
+
     @override
     async def create_rule(self, data: RuleCreate) -> RuleOut:
         return await self._inner.create_rule(data)
 
     @override
-    async def get_all_rules(self) -> list[RuleOut]:
-        return await self._inner.get_all_rules()
+    async def get_all_rules(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[RuleOut]:
+        return await self._inner.get_all_rules(limit, after)
+
+    @override
+    async def get_all_rules_payload(self) -> CachedPayload:
+        return await self._inner.get_all_rules_payload()
 
     @override
     async def get_rule(self, id: str) -> Optional[RuleOut]:
@@ -96,4 +146,4 @@ class AdminMockService(Service):
     @override
     async def notify_rules(self):
         rules = await self.get_all_rules()
-        self._notification_channel.append(RulePacket(rules=rules))
+        self._notification_channel.append(RulePacket(rules=rules.items))
@@ -0,0 +1,40 @@
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+from fastapi import HTTPException
+import asyncio
+import logging
+
+T = TypeVar("T")
+
+BULK_CONCURRENCY = 16
+
+logger = logging.getLogger(__name__)
+
+
+# Runs `action` for every item with at most `limit` of them in flight, and
+# returns, in the same order as the items, None for the ones that succeeded or
+# the HTTPException that made them fail. One failure never stops the others
+async def run_bounded(
+    items: Iterable[T],
+    action: Callable[[T], Awaitable[object]],
+    limit: int = BULK_CONCURRENCY,
+) -> list[Optional[HTTPException]]:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item: T) -> Optional[HTTPException]:
+        async with semaphore:
+            try:
+                await action(item)
+                return None
+            except HTTPException as e:
+                return e
+            except Exception as e:
+                logger.exception("Unexpected error in bulk operation")
+                return HTTPException(status_code=500, detail=str(e))
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def bulk_status(error: Optional[HTTPException]) -> dict:
+    if error is None:
+        return {"status_code": 200}
+    return {"status_code": error.status_code, "detail": error.detail}
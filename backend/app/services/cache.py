@@ -0,0 +1,102 @@
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+import asyncio
+import logging
+import time
+
+T = TypeVar("T")
+
+DEFAULT_TTL = 10.0
+DEFAULT_MAX_STALE = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+# Caches the result of `loader` for `ttl` seconds. Once expired, the old value
+# keeps being served while a single background refresh runs, for up to
+# `max_stale` more seconds; past that, callers wait for fresh data. A ttl of 0
+# disables caching altogether
+class StaleWhileRevalidate(Generic[T]):
+    def __init__(
+        self,
+        loader: Callable[[], Awaitable[T]],
+        ttl: float = DEFAULT_TTL,
+        max_stale: float = DEFAULT_MAX_STALE,
+    ):
+        self._loader = loader
+        self._ttl = ttl
+        self._max_stale = max_stale
+        self._value: Optional[T] = None
+        self._loaded_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+        self._pending_patches: list[Callable[[T], None]] = []
+
+    async def get(self) -> T:
+        if self._ttl <= 0:
+            return await self._loader()
+
+        age = time.monotonic() - self._loaded_at
+        if self._value is None or age >= self._ttl + self._max_stale:
+            # shielded, so a cancelled caller doesn't cancel the others' load
+            return await asyncio.shield(self._start_refresh())
+
+        if age >= self._ttl:
+            self._start_refresh()
+        return self._value
+
+    # Applies one of our own writes to the cached value, so it's seen right
+    # away instead of after the next refresh. Patches must be idempotent, they
+    # are applied again to data that was being loaded when they were made
+    def patch(self, fn: Callable[[T], None]):
+        if self._value is not None:
+            fn(self._value)
+        if self._refresh is not None:
+            self._pending_patches.append(fn)
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None:
+            self._refresh = asyncio.create_task(self._load())
+            self._refresh.add_done_callback(_consume_exception)
+        return self._refresh
+
+    async def _load(self) -> T:
+        try:
+            value = await self._loader()
+        except Exception:
+            if self._value is not None:
+                logger.warning("Cache refresh failed, serving stale data")
+            raise
+        finally:
+            self._refresh = None
+            patches, self._pending_patches = self._pending_patches, []
+
+        for fn in patches:
+            fn(value)
+        self._value = value
+        self._loaded_at = time.monotonic()
+        return value
+
+
+# Concurrent calls with the same key share a single execution of `fn` and
+# all get its result or exception. Nothing is kept once it finishes, so the
+# next call with that key runs `fn` again
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            call.add_done_callback(_consume_exception)
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+            self._calls[key] = call
+
+        # shielded, so a cancelled caller doesn't cancel it for the others
+        return await asyncio.shield(call)
+
+
+# Background refreshes aren't awaited by anyone, so their errors are collected
+# here to not be reported as never retrieved
+def _consume_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
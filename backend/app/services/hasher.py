@@ -0,0 +1,90 @@
+from typing import Optional
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from app.exceptions.hasher_busy import HasherBusy
+from app.controllers.metrics import (
+    HASHER_WORKERS,
+    HASHER_ACTIVE,
+    HASHER_QUEUE_DEPTH,
+    HASHER_QUEUE_LIMIT,
+    HASHER_REJECTED,
+)
+import asyncio
+import bcrypt
+import os
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_QUEUE_TIMEOUT = 5.0
+
+
+def default_workers() -> int:
+    return min(4, os.cpu_count() or 1)
+
+
+# Module level so they can be pickled into a process pool
+def _hashpw(password: bytes) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt())
+
+
+def _checkpw(plain: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(plain, hashed)
+
+
+# Runs bcrypt on a bounded worker pool so it never blocks the event loop.
+# At most `workers` operations run at once and at most `queue_size` wait for a
+# free worker; anything beyond that, or waiting longer than `queue_timeout`
+# seconds, fails with `HasherBusy`.
+class PasswordHasher:
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        use_processes: bool = False,
+    ):
+        workers = workers or default_workers()
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor: Executor = executor_cls(max_workers=workers)
+        self._slots = asyncio.Semaphore(workers)
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._waiting = 0
+
+        HASHER_WORKERS.set(workers)
+        HASHER_QUEUE_LIMIT.set(queue_size)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, fn, *args):
+        if self._slots.locked():
+            if self._waiting >= self._queue_size:
+                HASHER_REJECTED.inc()
+                raise HasherBusy()
+
+            self._waiting += 1
+            HASHER_QUEUE_DEPTH.inc()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self._queue_timeout)
+            except asyncio.TimeoutError:
+                HASHER_REJECTED.inc()
+                raise HasherBusy()
+            finally:
+                self._waiting -= 1
+                HASHER_QUEUE_DEPTH.dec()
+        else:
+            await self._slots.acquire()
+
+        HASHER_ACTIVE.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            HASHER_ACTIVE.dec()
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(_hashpw, password.encode())
+        return hashed.decode()
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self._run(_checkpw, plain.encode(), hashed.encode())
@@ -0,0 +1,35 @@
+from typing import Any, Dict, Optional
+from app.models.page import Page
+import base64
+import binascii
+
+MAX_PAGE_SIZE = 1000
+
+
+# Cursors are opaque to clients, they only wrap the id of the last item sent
+def encode_cursor(id: str) -> str:
+    return base64.urlsafe_b64encode(id.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        raw = base64.b64decode(cursor + padding, altchars=b"-_", validate=True)
+        return raw.decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+# Asks the db for one more document than needed, so we know whether a next
+# page exists without a second query
+def page_limit(limit: Optional[int]) -> Optional[int]:
+    return limit + 1 if limit else None
+
+
+def build_page(docs: list[Dict[str, Any]], limit: Optional[int], model) -> Page:
+    next_cursor = None
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["id"])
+
+    return Page(items=[model(**doc) for doc in docs], next_cursor=next_cursor)
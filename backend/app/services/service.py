@@ -1,6 +1,17 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
-from app.models.users import UserOut, EnrollmentUpdate, Enrollment
+from collections import defaultdict
+from typing import AsyncIterator, List, Optional
+from app.models.page import Page
+from app.models.payload import CachedPayload
+from app.models.users import (
+    UserOut,
+    EnrollmentUpdate,
+    Enrollment,
+    UserWithEnrollments,
+    LockStatusResult,
+    EnrollmentRoleChange,
+    EnrollmentUpdateResult,
+)
 from app.models.admin import (
     AdminCreate,
     AdminLogin,
@@ -10,6 +21,7 @@ from app.models.admin import (
     RuleOut,
     RuleUpdate,
 )
+import asyncio
 
 
 class Service(ABC):
@@ -22,7 +34,9 @@ class Service(ABC):
         pass
 
     @abstractmethod
-    async def get_all_admins(self) -> List[AdminOut]:
+    async def get_all_admins(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[AdminOut]:
         pass
 
     @abstractmethod
@@ -37,26 +51,69 @@ class Service(ABC):
     async def get_all_users(self) -> List[UserOut]:
         pass
 
+    # Same users as `get_all_users`, yielded one by one as they are read
+    @abstractmethod
+    def stream_all_users(self) -> AsyncIterator[UserOut]:
+        pass
+
     @abstractmethod
     async def get_all_users_enrollment(self) -> List[Enrollment]:
         pass
 
+    # Both lists are requested at the same time, so this takes as long as the
+    # slowest of them, and enrollments are grouped by user in a single pass
+    async def get_all_users_with_enrollments(self) -> List[UserWithEnrollments]:
+        users, enrollments = await asyncio.gather(
+            self.get_all_users(), self.get_all_users_enrollment()
+        )
+
+        enrollments_by_user = defaultdict(list)
+        for enrollment in enrollments:
+            enrollments_by_user[enrollment.userId].append(enrollment)
+
+        # the users and enrollments were validated already, no need to redo it
+        return [
+            UserWithEnrollments.model_construct(
+                **dict(user), enrollments=enrollments_by_user.get(user.uuid, [])
+            )
+            for user in users
+        ]
+
     @abstractmethod
     async def update_user_lock_status(self, uuid: str, locked: bool):
         pass
 
+    @abstractmethod
+    async def update_users_lock_status(
+        self, uuids: List[str], locked: bool
+    ) -> List[LockStatusResult]:
+        pass
+
     @abstractmethod
     async def update_user_enrollment(
         self, courseId: str, uuid: str, enrollmentData: EnrollmentUpdate
     ):
         pass
 
+    @abstractmethod
+    async def update_users_enrollment(
+        self, updates: List[EnrollmentRoleChange]
+    ) -> List[EnrollmentUpdateResult]:
+        pass
+
     @abstractmethod
     async def create_rule(self, data: RuleCreate) -> RuleOut:
         pass
 
     @abstractmethod
-    async def get_all_rules(self) -> list[RuleOut]:
+    async def get_all_rules(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[RuleOut]:
+        pass
+
+    # Every rule already serialized as a JSON list
+    @abstractmethod
+    async def get_all_rules_payload(self) -> CachedPayload:
         pass
 
     @abstractmethod
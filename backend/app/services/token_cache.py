@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from typing import Optional
+from app.controllers.metrics import TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES
+import hashlib
+import time
+
+DEFAULT_TOKEN_CACHE_SIZE = 1024
+
+
+# LRU of tokens whose signature and claims were already verified, so repeated
+# requests with the same bearer token skip decoding it. Entries are keyed by
+# the token's digest and dropped once the token expires. Tokens without an
+# `exp` claim are never cached
+class VerifiedTokenCache:
+    def __init__(self, max_size: int = DEFAULT_TOKEN_CACHE_SIZE):
+        self._max_size = max_size
+        self._tokens: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = _digest(token)
+        entry = self._tokens.get(key)
+        if entry is None:
+            TOKEN_CACHE_MISSES.inc()
+            return None
+
+        claims, exp = entry
+        if time.time() >= exp:
+            del self._tokens[key]
+            TOKEN_CACHE_MISSES.inc()
+            return None
+
+        self._tokens.move_to_end(key)
+        TOKEN_CACHE_HITS.inc()
+        return claims
+
+    def put(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        if self._max_size <= 0 or not isinstance(exp, (int, float)):
+            return
+
+        key = _digest(token)
+        self._tokens[key] = (claims, exp)
+        self._tokens.move_to_end(key)
+        if len(self._tokens) > self._max_size:
+            self._tokens.popitem(last=False)
+
+
+def _digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
@@ -0,0 +1,180 @@
+from fastapi import FastAPI
+from fastapi.security import HTTPAuthorizationCredentials
+from app.models.admin import AdminCreate
+from app.routers.admin import validate_token_with_secret_key
+from app.middlewares.metrics import MetricsMiddleware
+from benchmarks.conftest import (
+    BenchApp,
+    SECRET_KEY,
+    LIST_SIZES,
+    auth_headers,
+    rounds_for,
+    run_sync,
+)
+from datetime import datetime
+import itertools
+import pytest
+import httpx
+
+RULE = {
+    "title": "rule",
+    "description": "A rule",
+    "effective_date": "2025-01-01",
+    "applicable_conditions": ["always"],
+}
+
+
+def add_admins(app: BenchApp, count: int):
+    registration_date = datetime.utcnow().isoformat() + "Z"
+    for i in range(count):
+        app.run(
+            app.db.create(
+                "admins",
+                {
+                    "username": f"admin{i}",
+                    "email": f"admin{i}@example.com",
+                    "password": "not-a-real-hash",
+                    "registration_date": registration_date,
+                },
+            )
+        )
+
+
+###
+# Login
+###
+
+
+def bench_login(benchmark, bench_app: BenchApp):
+    admin = AdminCreate(
+        username="admin", email="admin@example.com", password="password"
+    )
+    bench_app.run(bench_app.service.create_admin(admin))
+    credentials = {"email": admin.email, "password": admin.password}
+
+    benchmark(bench_app.request, "POST", "/admins/login", json=credentials)
+
+
+###
+# Rules
+###
+
+
+def bench_create_rule(benchmark, bench_app: BenchApp):
+    titles = (f"rule {i}" for i in itertools.count())
+
+    def create():
+        bench_app.request("POST", "/admins/rules", json={**RULE, "title": next(titles)})
+
+    benchmark(create)
+
+
+def bench_get_rule(benchmark, bench_app: BenchApp):
+    rule = bench_app.request("POST", "/admins/rules", json=RULE).json()
+    benchmark(bench_app.request, "GET", f"/admins/rules/{rule['id']}")
+
+
+def bench_update_rule(benchmark, bench_app: BenchApp):
+    rule = bench_app.request("POST", "/admins/rules", json=RULE).json()
+    descriptions = (f"Version {i}" for i in itertools.count())
+
+    def update():
+        update = {"admin_name": "admin", "update": {"description": next(descriptions)}}
+        bench_app.request("PATCH", f"/admins/rules/{rule['id']}", json=update)
+
+    benchmark(update)
+
+
+def bench_get_all_rules(benchmark, bench_app: BenchApp):
+    for i in range(100):
+        bench_app.request("POST", "/admins/rules", json={**RULE, "title": f"rule {i}"})
+
+    benchmark(bench_app.request, "GET", "/admins/rules")
+
+
+###
+# Lists
+###
+
+
+@pytest.mark.parametrize("size", LIST_SIZES)
+def bench_list_admins(benchmark, loop, size: int):
+    app = BenchApp(loop)
+    add_admins(app, size)
+
+    benchmark.pedantic(
+        app.request, ("GET", "/admins"), rounds=rounds_for(size), warmup_rounds=1
+    )
+    app.close()
+
+
+# `fast_json` off is the plain FastAPI response, to compare the two
+@pytest.mark.parametrize("fast_json", [False, True])
+@pytest.mark.parametrize("size", LIST_SIZES)
+def bench_list_users(benchmark, loop, size: int, fast_json: bool):
+    app = BenchApp(loop, users=size, fast_json=fast_json)
+
+    # the first request fills the cache, the rest are served from it
+    benchmark.pedantic(
+        app.request, ("GET", "/admins/users"), rounds=rounds_for(size), warmup_rounds=1
+    )
+    app.close()
+
+
+@pytest.mark.parametrize("size", LIST_SIZES)
+def bench_list_users_with_enrollments(benchmark, loop, size: int):
+    app = BenchApp(loop, users=size)
+
+    benchmark.pedantic(
+        app.request,
+        ("GET", "/admins/users/with-enrollments"),
+        rounds=rounds_for(size),
+        warmup_rounds=1,
+    )
+    app.close()
+
+
+# Without the cache every request fetches and parses the whole list
+@pytest.mark.parametrize("size", LIST_SIZES[:2])
+def bench_fetch_users(benchmark, loop, size: int):
+    app = BenchApp(loop, users=size, cache_ttl=0)
+
+    benchmark.pedantic(app.request, ("GET", "/admins/users"), rounds=rounds_for(size))
+    app.close()
+
+
+###
+# Auth
+###
+
+
+@pytest.mark.parametrize("cache_size", [0, 1024], ids=["uncached", "cached"])
+def bench_validate_token(benchmark, cache_size: int):
+    validate_token = validate_token_with_secret_key(SECRET_KEY, cache_size)
+    token = auth_headers()["Authorization"].removeprefix("Bearer ")
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    benchmark(lambda: run_sync(validate_token(credentials)))
+
+
+###
+# Metrics middleware
+###
+
+
+@pytest.mark.parametrize("with_metrics", [False, True], ids=["bare", "metrics"])
+def bench_metrics_middleware(benchmark, loop, with_metrics: bool):
+    app = FastAPI()
+
+    @app.get("/ping/{id}")
+    async def ping(id: str):
+        return {}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+
+    client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://backoffice"
+    )
+    benchmark(lambda: loop.run_until_complete(client.get("/ping/1")))
+    loop.run_until_complete(client.aclose())
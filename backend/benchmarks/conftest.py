@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from fastapi import FastAPI
+from app.databases.dict import DictDB
+from app.gateway.client import GatewayClient
+from app.services.admin import AdminService
+from app.services.hasher import PasswordHasher
+from app.controllers.admin import AdminController
+from app.routers.admin import AdminRouter
+from app.middlewares.metrics import MetricsMiddleware
+from benchmarks.stub_gateway import build_stub_gateway
+import asyncio
+import pytest
+import httpx
+import jwt
+
+SECRET_KEY = "benchmark"
+LIST_SIZES = [1_000, 10_000, 100_000]
+
+
+def auth_headers() -> dict:
+    payload = {"exp": datetime.utcnow() + timedelta(hours=1)}
+    return {"Authorization": f"Bearer {jwt.encode(payload, SECRET_KEY)}"}
+
+
+# The app wired like in main.py, but against DictDB and an in-process stub
+# gateway, so nothing leaves the process
+class BenchApp:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        users: int = 1000,
+        cache_ttl: float = 3600.0,
+        fast_json: bool = True,
+    ):
+        self.loop = loop
+        self.db = DictDB()
+        self.gateway = GatewayClient(
+            "http://gateway",
+            "benchmark-token",
+            transport=httpx.ASGITransport(app=build_stub_gateway(users, users)),
+        )
+        self.hasher = PasswordHasher()
+        self.service = AdminService(
+            self.db, self.gateway, SECRET_KEY, self.hasher, cache_ttl=cache_ttl
+        )
+        loop.run_until_complete(self.service.ensure_indexes())
+
+        router = AdminRouter(
+            AdminController(self.service), SECRET_KEY, fast_json=fast_json
+        )
+        self.app = FastAPI()
+        self.app.include_router(router.router)
+        self.app.add_middleware(MetricsMiddleware)
+
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app),
+            base_url="http://backoffice",
+            headers=auth_headers(),
+        )
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        res = self.run(self.client.request(method, url, **kwargs))
+        assert res.status_code < 400, res.text
+        return res
+
+    def close(self):
+        self.run(self.client.aclose())
+        self.run(self.gateway.close())
+        self.hasher.close()
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+# Fewer rounds for the bigger lists, a single request for 100k admins takes
+# seconds
+def rounds_for(size: int) -> int:
+    return max(2, 20_000 // size)
+
+
+# Runs a coroutine that never suspends without going through the event loop,
+# whose overhead would be most of what's measured for very cheap calls
+def run_sync(coro):
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("The coroutine suspended")
+
+
+@pytest.fixture
+def bench_app(loop):
+    app = BenchApp(loop)
+    yield app
+    app.close()
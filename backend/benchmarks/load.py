@@ -0,0 +1,284 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+import subprocess
+import argparse
+import asyncio
+import random
+import time
+import json
+import sys
+import os
+import httpx
+import jwt
+
+DEFAULT_SECRET = "secret"
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN = {
+    "username": "loadtest",
+    "email": "loadtest@example.com",
+    "password": "password",
+}
+RULE = {
+    "title": "rule",
+    "description": "A rule",
+    "effective_date": "2025-01-01",
+    "applicable_conditions": ["always"],
+}
+
+
+@dataclass
+class Route:
+    method: str
+    path: str
+    body: Optional[Callable[[random.Random], Any]] = None
+
+
+# `{uuid}` and `{courseId}` are filled in with random ids of the stub's data
+ROUTES = {
+    "admins": Route("GET", "/admins"),
+    "users": Route("GET", "/admins/users"),
+    "users-with-enrollments": Route("GET", "/admins/users/with-enrollments"),
+    "enrollments": Route("GET", "/admins/courses/enrollments"),
+    "rules": Route("GET", "/admins/rules"),
+    "lock-status": Route(
+        "PATCH",
+        "/admins/users/{uuid}/lock-status",
+        lambda rng: {"locked": rng.random() < 0.5},
+    ),
+    "enrollment": Route(
+        "PATCH",
+        "/admins/courses/{courseId}/enrollments/{uuid}",
+        lambda rng: {"role": rng.choice(["STUDENT", "ASSISTANT"])},
+    ),
+    "login": Route(
+        "POST",
+        "/admins/login",
+        lambda rng: {"email": ADMIN["email"], "password": ADMIN["password"]},
+    ),
+}
+DEFAULT_ROUTES = ["admins", "users", "enrollments", "rules", "lock-status"]
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def setup(client: httpx.AsyncClient, rules: int):
+    # they may exist already from a previous run against the same server
+    await client.post("/admins", json=ADMIN)
+    for i in range(rules):
+        await client.post("/admins/rules", json={**RULE, "title": f"rule {i}"})
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    routes: list[str],
+    stats: dict[str, RouteStats],
+    deadline: float,
+    users: int,
+    rng: random.Random,
+):
+    while time.monotonic() < deadline:
+        name = rng.choice(routes)
+        route = ROUTES[name]
+        path = route.path.format(uuid=rng.randrange(users), courseId=rng.randrange(100))
+        body = route.body(rng) if route.body else None
+
+        start = time.perf_counter()
+        try:
+            res = await client.request(route.method, path, json=body)
+            status = res.status_code
+        except httpx.HTTPError:
+            status = 0
+        latency = time.perf_counter() - start
+
+        route_stats = stats[name]
+        route_stats.latencies.append(latency)
+        route_stats.statuses[status] = route_stats.statuses.get(status, 0) + 1
+        if not 200 <= status < 400:
+            route_stats.errors += 1
+
+
+async def run_load(args) -> dict[str, RouteStats]:
+    payload = {"exp": datetime.utcnow() + timedelta(hours=1)}
+    token = jwt.encode(payload, args.secret, algorithm="HS256")
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=args.timeout,
+        limits=limits,
+    ) as client:
+        await setup(client, args.rules)
+
+        if args.warmup:
+            warmup = {name: RouteStats() for name in args.routes}
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(
+                *(
+                    worker(client, args.routes, warmup, deadline, args.users, rng)
+                    for rng in (random.Random(i) for i in range(args.concurrency))
+                )
+            )
+
+        stats = {name: RouteStats() for name in args.routes}
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(
+            *(
+                worker(client, args.routes, stats, deadline, args.users, rng)
+                for rng in (
+                    random.Random(args.seed + i) for i in range(args.concurrency)
+                )
+            )
+        )
+        return stats
+
+
+def report(stats: dict[str, RouteStats], duration: float) -> list[dict]:
+    rows = []
+    for name, route_stats in stats.items():
+        latencies = route_stats.latencies
+        rows.append(
+            {
+                "route": name,
+                "requests": len(latencies),
+                "errors": route_stats.errors,
+                "rps": len(latencies) / duration,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": max(latencies, default=0) * 1000,
+                "statuses": route_stats.statuses,
+            }
+        )
+
+    header = f"{'route':<24}{'requests':>10}{'errors':>8}{'rps':>10}"
+    header += f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    for row in rows:
+        print(
+            f"{row['route']:<24}{row['requests']:>10}{row['errors']:>8}"
+            f"{row['rps']:>10.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+            f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+        )
+    total = sum(row["requests"] for row in rows)
+    print(f"total: {total} requests, {total / duration:.1f} rps")
+    return rows
+
+
+def spawn(module: str, *args: str) -> subprocess.Popen:
+    command = [sys.executable, "-m", f"benchmarks.{module}", *args]
+    return subprocess.Popen(command, cwd=BACKEND_DIR)
+
+
+def ensure_port_free(url: str):
+    try:
+        httpx.get(url, timeout=1.0)
+    except httpx.TransportError:
+        return
+    raise RuntimeError(f"Something is already listening on {url}")
+
+
+# Fails if the process exits, so a server that couldn't start is never
+# mistaken for another one answering on the same port
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server for {url} exited")
+        try:
+            httpx.get(url, timeout=1.0)
+        except httpx.TransportError:
+            time.sleep(0.1)
+            continue
+
+        if process.poll() is not None:
+            raise RuntimeError(f"The server for {url} exited")
+        return
+    raise RuntimeError(f"{url} didn't come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the app with HTTP load")
+    parser.add_argument("--url", default="http://127.0.0.1:3004")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--routes",
+        nargs="+",
+        choices=list(ROUTES),
+        default=DEFAULT_ROUTES,
+        metavar="ROUTE",
+        help=f"any of: {', '.join(ROUTES)}",
+    )
+    parser.add_argument("--rules", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--secret", default=os.getenv("JWT_SECRET", DEFAULT_SECRET))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+
+    spawned = parser.add_argument_group("spawning the app and a stub gateway")
+    spawned.add_argument("--spawn", action="store_true")
+    spawned.add_argument("--gateway-port", type=int, default=3001)
+    spawned.add_argument("--enrollments", type=int, default=1000)
+    spawned.add_argument("--description-size", type=int, default=16)
+    spawned.add_argument("--latency", help="e.g. fixed:20 or lognormal:50:0.5")
+    spawned.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.spawn:
+            gateway_url = f"http://127.0.0.1:{args.gateway_port}"
+            stub_args = [
+                f"--port={args.gateway_port}",
+                f"--users={args.users}",
+                f"--enrollments={args.enrollments}",
+                f"--description-size={args.description_size}",
+                f"--error-rate={args.error_rate}",
+                f"--seed={args.seed}",
+            ]
+            if args.latency:
+                stub_args.append(f"--latency={args.latency}")
+
+            ensure_port_free(gateway_url)
+            ensure_port_free(args.url)
+
+            gateway = spawn("stub_gateway", *stub_args)
+            processes.append(gateway)
+            wait_until_up(gateway_url, gateway)
+
+            port = httpx.URL(args.url).port
+            app = spawn("serve", f"--port={port}", f"--gateway={gateway_url}")
+            processes.append(app)
+            wait_until_up(args.url, app)
+
+        stats = asyncio.run(run_load(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    rows = report(stats, args.duration)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "routes": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+from app.databases.dict import DictDB
+import argparse
+import uvicorn
+import os
+
+STUB_GATEWAY_TOKEN = "stub-gateway-token"
+
+
+# Runs the real app from app.main, with its config, middlewares and lifespan,
+# but with an in-memory DictDB in place of MongoDB so no database is needed
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app on an in-memory DB")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3004)
+    parser.add_argument("--gateway", default="http://127.0.0.1:3001")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_URI", "memory://")
+    os.environ.setdefault("DB_NAME", "benchmark")
+    # never taken from the environment, it could point at the real gateway
+    os.environ["GATEWAY_TOKEN"] = STUB_GATEWAY_TOKEN
+    os.environ["GATEWAY_URL"] = args.gateway
+    os.environ.setdefault("FAST_JSON_RESPONSES", "true")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import app.main
+
+    app.main.MongoDB = lambda uri, name: DictDB()
+    uvicorn.run(app.main.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+from typing import Callable, Optional
+from starlette.types import ASGIApp, Receive, Scope, Send
+from fastapi import FastAPI, Response
+import argparse
+import asyncio
+import random
+import uvicorn
+import json
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def fake_user(i: int, description_size: int = 16) -> dict:
+    return {
+        "uuid": str(i),
+        "email": f"user{i}@example.com",
+        "name": f"user {i}",
+        "urlProfilePhoto": f"https://example.com/photos/{i}.jpg",
+        "description": "x" * description_size,
+        "createdAt": "2025-05-20T15:00:00Z",
+        "accountLockedByAdmins": False,
+    }
+
+
+def fake_enrollment(i: int) -> dict:
+    return {
+        "role": "STUDENT",
+        "userId": str(i),
+        "course": {"id": i % 100, "title": f"Course {i % 100}"},
+    }
+
+
+# Latency distributions in milliseconds, written as
+#   fixed:<ms>, uniform:<min>:<max>, exp:<mean> or lognormal:<median>:<sigma>
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    kind, *args = spec.split(":")
+    try:
+        params = [float(arg) for arg in args]
+        if kind == "fixed":
+            [ms] = params
+            return lambda: ms / 1000
+        if kind == "uniform":
+            low, high = params
+            return lambda: rng.uniform(low, high) / 1000
+        if kind == "exp":
+            [mean] = params
+            return lambda: rng.expovariate(1 / mean) / 1000
+        if kind == "lognormal":
+            median, sigma = params
+            return lambda: rng.lognormvariate(0, sigma) * median / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency `{spec}`")
+
+
+# Delays every request and fails a share of them, before the stub answers
+class Chaos:
+    def __init__(
+        self,
+        app: ASGIApp,
+        latency: Optional[Callable[[], float]] = None,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        rng: Optional[random.Random] = None,
+    ):
+        self.app = app
+        self._latency = latency
+        self._error_rate = error_rate
+        self._error_status = error_status
+        self._rng = rng or random.Random()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self._latency:
+            await asyncio.sleep(self._latency())
+        if self._rng.random() < self._error_rate:
+            await Response(status_code=self._error_status)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# Stands in for the gateway, answering every endpoint the admin service calls.
+# Payloads are built once, so serving them costs next to nothing
+def build_stub_gateway(
+    users: int = 1000,
+    enrollments: int = 1000,
+    description_size: int = 16,
+    latency: Optional[str] = None,
+    error_rate: float = 0.0,
+    error_status: int = 503,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    users_body = json.dumps(
+        [fake_user(i, description_size) for i in range(users)]
+    ).encode()
+    enrollments_body = json.dumps(
+        {"data": [fake_enrollment(i) for i in range(enrollments)]}
+    ).encode()
+
+    app = FastAPI()
+
+    @app.get("/admin-backend/users")
+    async def get_users():
+        return Response(content=users_body, media_type=JSON_MEDIA_TYPE)
+
+    @app.get("/admin-backend/courses/enrollments")
+    async def get_enrollments():
+        return Response(content=enrollments_body, media_type=JSON_MEDIA_TYPE)
+
+    @app.patch("/admin-backend/users/{uuid}/lock-status", status_code=204)
+    async def update_lock_status(uuid: str):
+        pass
+
+    @app.patch("/admin-backend/courses/{courseId}/enrollments/{uuid}", status_code=204)
+    async def update_enrollment(courseId: str, uuid: str):
+        pass
+
+    @app.post("/email/rules", status_code=204)
+    async def notify_rules():
+        pass
+
+    rng = random.Random(seed)
+    app.add_middleware(
+        Chaos,
+        latency=parse_latency(latency, rng) if latency else None,
+        error_rate=error_rate,
+        error_status=error_status,
+        rng=rng,
+    )
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stub of the gateway")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--enrollments", type=int, default=1000)
+    parser.add_argument("--description-size", type=int, default=16)
+    parser.add_argument("--latency", help="e.g. fixed:20 or lognormal:50:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    app = build_stub_gateway(
+        args.users,
+        args.enrollments,
+        args.description_size,
+        args.latency,
+        args.error_rate,
+        args.error_status,
+        args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,51 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
-from app.models.users import UserOut, Enrollment, EnrollmentUpdate
+from fastapi.responses import StreamingResponse
+from app.models.users import (
+    UserOut,
+    Enrollment,
+    EnrollmentUpdate,
+    EnrollmentRoleChange,
+)
 from app.routers.admin import AdminRouter
 from app.controllers.admin import AdminController
+from app.controllers.metrics import MetricsController, registry
+from app.middlewares.metrics import MetricsMiddleware
+from app.middlewares.request_context import RequestContextMiddleware
+from app.log import DEFAULT_LEVELS, initialize_log
 from app.services.admin import AdminService
 from app.services.admin_mock import AdminMockService
 from app.databases.dict import DictDB
+from app.gateway.breaker import CircuitBreaker, CircuitOpen, CircuitState
+from app.gateway.client import GatewayClient
+from app.gateway.json_stream import JSONArrayItems
+from app.services.hasher import PasswordHasher
+from app.services.cache import StaleWhileRevalidate, SingleFlight
+from app.services.token_cache import VerifiedTokenCache
+from app.services import token_cache
+from app.exceptions.hasher_busy import HasherBusy
+from app.exceptions.duplicate_key import DuplicateKey
+from prometheus_client.parser import text_string_to_metric_families
 from datetime import datetime, timedelta
 from collections import deque
 from app.models.admin import (
     AdminCreate,
     AdminLogin,
     LockStatusUpdate,
+    RuleCreate,
     RuleOut,
     RulePacket,
 )
+import asyncio
+import json
+import logging
+import subprocess
+import threading
 import pytest
+import httpx
+import time
+import sys
+import os
 import jwt
 
 
@@ -70,19 +100,25 @@ notification_channel: deque[RulePacket] = deque()
 SECRET_KEY = "testing"
 
 
-@pytest.fixture
-def app():
+def build_app(users=users, fast_json=False) -> FastAPI:
     db = DictDB()
-    service = AdminService(db, "testing-token", "testing-url", SECRET_KEY)
+    gateway = GatewayClient("testing-url", "testing-token")
+    service = AdminService(db, gateway, SECRET_KEY)
+    asyncio.run(service.ensure_indexes())
     mock_service = AdminMockService(service, users, enrollments, notification_channel)
     controller = AdminController(mock_service)
-    router = AdminRouter(controller, SECRET_KEY)
+    router = AdminRouter(controller, SECRET_KEY, fast_json=fast_json)
 
     app = FastAPI()
     app.include_router(router.router)
     return app
 
 
+@pytest.fixture
+def app():
+    return build_app()
+
+
 def generate_test_token():
     payload = {"exp": datetime.utcnow() + timedelta(minutes=30)}
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
@@ -106,6 +142,39 @@ def test_hitting_endpoint_without_token(client: TestClient):
     assert res.status_code == 401
 
 
+def test_verified_tokens_are_cached(monkeypatch):
+    cache = VerifiedTokenCache(max_size=2)
+    now = time.time()
+    monkeypatch.setattr(token_cache.time, "time", lambda: now)
+
+    assert cache.get("a") is None
+    cache.put("a", {"exp": now + 10})
+    cache.put("b", {"exp": now + 10})
+    cache.put("no-exp", {})
+    assert cache.get("a") == {"exp": now + 10}
+    assert cache.get("no-exp") is None
+
+    # "b" is the least recently used
+    cache.put("c", {"exp": now + 10})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    monkeypatch.setattr(token_cache.time, "time", lambda: now + 10)
+    assert cache.get("a") is None
+
+
+def test_expired_token_is_not_served_from_cache(client: TestClient):
+    exp = int(time.time()) + 1
+    token = jwt.encode({"exp": exp}, SECRET_KEY, algorithm="HS256")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/admins", headers=headers).status_code == 200
+    assert client.get("/admins", headers=headers).status_code == 200
+
+    time.sleep(exp - time.time() + 0.01)
+    assert client.get("/admins", headers=headers).status_code == 401
+
+
 ###
 #
 # Admin Creation
@@ -208,6 +277,35 @@ def test_get_all_admins(client: TestClient):
     assert {admin["username"] for admin in getted} == {"bob", "carol"}
 
 
+def test_get_all_admins_paginated(client: TestClient):
+    usernames = ["bob", "carol", "dave"]
+    for username in usernames:
+        admin = AdminCreate(
+            username=username, email=f"{username}@example.com", password="password"
+        )
+        client.post("/admins", json=admin.model_dump(), headers=VALID_HEADERS)
+
+    getted = []
+    params = {"limit": 2}
+    while True:
+        res = client.get("/admins", params=params, headers=VALID_HEADERS)
+        assert res.status_code == 200
+        assert len(res.json()) <= 2
+        getted.extend(admin["username"] for admin in res.json())
+
+        cursor = res.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        params["after"] = cursor
+
+    assert getted == usernames
+
+
+def test_get_all_admins_invalid_cursor(client: TestClient):
+    res = client.get("/admins", params={"after": "%%%"}, headers=VALID_HEADERS)
+    assert res.status_code == 400
+
+
 ###
 #
 # Admin Deletion
@@ -289,6 +387,63 @@ def test_get_all_users(client: TestClient):
     assert data[1]["email"] == "maria@example.com"
 
 
+def test_stream_all_users(client: TestClient):
+    headers = {**VALID_HEADERS, "Accept": "application/x-ndjson"}
+    with client.stream("GET", "/admins/users", headers=headers) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        data = [UserOut.model_validate_json(line) for line in response.iter_lines()]
+
+    assert data == list(users.values())
+
+
+def test_get_all_users_with_enrollments(client: TestClient):
+    response = client.get("/admins/users/with-enrollments", headers=VALID_HEADERS)
+    assert response.status_code == 200
+
+    data = response.json()
+    assert [user["uuid"] for user in data] == ["1", "2"]
+    assert all(user["enrollments"] == [] for user in data)
+
+
+def test_fast_json_matches_default():
+    service = AdminService(
+        DictDB(), GatewayClient("testing-url", "testing-token"), SECRET_KEY
+    )
+    mock_service = AdminMockService(service, users, enrollments, notification_channel)
+    controller = AdminController(mock_service)
+
+    clients = []
+    for fast in (False, True):
+        app = FastAPI()
+        app.include_router(AdminRouter(controller, SECRET_KEY, fast_json=fast).router)
+        clients.append(TestClient(app))
+
+    for name in ("first", "second"):
+        admin = AdminCreate(
+            username=name, email=f"{name}@example.com", password="password"
+        )
+        res = clients[0].post("/admins", json=admin.model_dump(), headers=VALID_HEADERS)
+        assert res.status_code == 201
+
+    for url in [
+        "/admins/users",
+        "/admins/users/with-enrollments",
+        "/admins/courses/enrollments",
+        "/admins",
+    ]:
+        default, fast = [client.get(url, headers=VALID_HEADERS) for client in clients]
+        assert fast.headers["content-type"] == "application/json"
+        assert fast.json() == default.json()
+
+    default, fast = [
+        client.get("/admins", params={"limit": 1}, headers=VALID_HEADERS)
+        for client in clients
+    ]
+    assert [a["username"] for a in fast.json()] == ["first"]
+    assert "X-Next-Cursor" in fast.headers
+
+
 ###
 #
 # User Lock Status
@@ -326,6 +481,36 @@ def test_lock_status_invalid_id(client: TestClient):
     assert res.status_code == 404
 
 
+def test_bulk_lock_status(client: TestClient):
+    res = client.patch(
+        "/admins/users/lock-status",
+        json={"uuids": ["1", "2", "123456789"], "locked": True},
+        headers=VALID_HEADERS,
+    )
+
+    assert res.status_code == 200
+    assert [(r["uuid"], r["status_code"]) for r in res.json()] == [
+        ("1", 200),
+        ("2", 200),
+        ("123456789", 404),
+    ]
+    assert users["1"].accountLockedByAdmins
+    assert users["2"].accountLockedByAdmins
+
+    # unwind global state
+    users["1"].accountLockedByAdmins = False
+    users["2"].accountLockedByAdmins = False
+
+
+def test_bulk_lock_status_empty(client: TestClient):
+    res = client.patch(
+        "/admins/users/lock-status",
+        json={"uuids": [], "locked": True},
+        headers=VALID_HEADERS,
+    )
+    assert res.status_code == 422
+
+
 ###
 #
 # User Enrollment Retrieval
@@ -372,6 +557,30 @@ def test_update_user_enrollment(client: TestClient):
     enrollments[user_uuid][enrollment_uuid].role = "student"
 
 
+def test_bulk_update_user_enrollment(client: TestClient):
+    updates = [
+        {"courseId": "101", "uuid": "1", "role": "assistant"},
+        {"courseId": "102", "uuid": "2", "role": "assistant"},
+        {"courseId": "999", "uuid": "1", "role": "assistant"},
+    ]
+
+    res = client.patch(
+        "/admins/courses/enrollments",
+        json={"updates": updates},
+        headers=VALID_HEADERS,
+    )
+
+    assert res.status_code == 200
+    assert [r["status_code"] for r in res.json()] == [200, 200, 404]
+    assert res.json()[0]["courseId"] == "101"
+    assert enrollments["1"]["101"].role == "assistant"
+    assert enrollments["2"]["102"].role == "assistant"
+
+    # unwind global state
+    enrollments["1"]["101"].role = "student"
+    enrollments["2"]["102"].role = "teacher"
+
+
 ###
 #
 # Rules creation
@@ -430,6 +639,81 @@ def test_create_rule_with_same_title(client: TestClient):
     assert res.status_code == 409
 
 
+def test_get_all_rules_paginated(client: TestClient):
+    for title in ["first", "second"]:
+        client.post(
+            "/admins/rules", json={**base_rule, "title": title}, headers=VALID_HEADERS
+        )
+
+    res = client.get("/admins/rules", params={"limit": 1})
+    assert res.status_code == 200
+    assert [rule["title"] for rule in res.json()] == ["first"]
+
+    cursor = res.headers["X-Next-Cursor"]
+    res = client.get("/admins/rules", params={"limit": 1, "after": cursor})
+    assert res.status_code == 200
+    assert [rule["title"] for rule in res.json()] == ["second"]
+    assert "X-Next-Cursor" not in res.headers
+
+
+def test_get_all_rules_etag(client: TestClient):
+    res = client.get("/admins/rules")
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+
+    res = client.get("/admins/rules", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    res = client.post("/admins/rules", json=base_rule, headers=VALID_HEADERS)
+    assert res.status_code == 201
+    id = res.json()["id"]
+
+    res = client.get("/admins/rules", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert len(res.json()) == 1
+    etag = res.headers["ETag"]
+
+    res = client.patch(
+        f"/admins/rules/{id}",
+        json={"admin_name": "name", "update": {"title": "new title"}},
+        headers=VALID_HEADERS,
+    )
+    assert res.status_code == 200
+
+    res = client.get("/admins/rules", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()[0]["title"] == "new title"
+
+
+class CountingDictDB(DictDB):
+    def __init__(self):
+        super().__init__()
+        self.get_all_calls = 0
+
+    async def get_all(self, *args, **kwargs):
+        self.get_all_calls += 1
+        return await super().get_all(*args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_rules_payload_is_cached():
+    db = CountingDictDB()
+    service = AdminService(
+        db, GatewayClient("testing-url", "testing-token"), SECRET_KEY
+    )
+
+    first = await service.get_all_rules_payload()
+    second = await service.get_all_rules_payload()
+    assert first == second
+    assert db.get_all_calls == 1
+
+    await service.create_rule(RuleCreate(**base_rule))
+    third = await service.get_all_rules_payload()
+    assert third.etag != first.etag
+    assert db.get_all_calls == 2
+
+
 ###
 #
 # Rule Updating
@@ -480,6 +764,24 @@ def test_rule_update_does_not_exist(client: TestClient):
     assert res.status_code == 404
 
 
+def test_rule_update_to_title_in_use(client: TestClient):
+    client.post("/admins/rules", json=base_rule, headers=VALID_HEADERS)
+    res = client.post(
+        "/admins/rules", json={**base_rule, "title": "other"}, headers=VALID_HEADERS
+    )
+    id = RuleOut(**res.json()).id
+
+    res = client.patch(
+        f"/admins/rules/{id}",
+        json={"admin_name": "name", "update": {"title": base_rule["title"]}},
+        headers=VALID_HEADERS,
+    )
+    assert res.status_code == 409
+
+    res = client.get(f"/admins/rules/{id}", headers=VALID_HEADERS)
+    assert res.json()["title"] == "other"
+
+
 def test_rule_update_partial_data(client: TestClient):
     res = client.post(
         "/admins/rules",
@@ -539,3 +841,806 @@ def test_sending_notifications(client: TestClient):
 
     pkt = notification_channel.popleft()
     assert len(pkt.rules) == 1
+
+
+###
+#
+# Gateway
+#
+###
+def gateway_with_handler(handler) -> GatewayClient:
+    return GatewayClient(
+        "http://gateway", "testing-token", transport=httpx.MockTransport(handler)
+    )
+
+
+@pytest.mark.asyncio
+async def test_gateway_get_all_users():
+    def handler(request: httpx.Request):
+        assert request.url.path == "/admin-backend/users"
+        assert request.headers["Authorization"] == "Bearer testing-token"
+        return httpx.Response(200, json=[user.model_dump() for user in users.values()])
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    result = await service.get_all_users()
+    await gateway.close()
+
+    assert result == list(users.values())
+
+
+@pytest.mark.asyncio
+async def test_gateway_stream_all_users():
+    body = json.dumps([user.model_dump() for user in users.values()]).encode()
+
+    # hand the body over in small pieces to exercise the incremental parser
+    async def chunked():
+        for i in range(0, len(body), 7):
+            yield body[i : i + 7]
+
+    def handler(request: httpx.Request):
+        assert request.url.path == "/admin-backend/users"
+        return httpx.Response(200, content=chunked())
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    result = [user async for user in service.stream_all_users()]
+    await gateway.close()
+
+    assert result == list(users.values())
+
+
+def test_json_array_items_split_anywhere():
+    data = [{"name": 'tricky ,]}" \\', "tags": [1, [2]]}, "text", 3, None]
+    raw = json.dumps(data).encode()
+
+    items = JSONArrayItems()
+    parsed = [json.loads(item) for byte in raw for item in items.feed(bytes([byte]))]
+    items.close()
+
+    assert parsed == data
+
+
+def test_json_array_items_truncated():
+    items = JSONArrayItems()
+    items.feed(b'[{"a": 1}, {"b"')
+
+    with pytest.raises(ValueError):
+        items.close()
+
+
+@pytest.mark.asyncio
+async def test_gateway_users_with_enrollments():
+    enrollments_requested = asyncio.Event()
+    enrollment = {"role": "student", "userId": "1", "course": {"id": 1, "title": "t"}}
+
+    async def handler(request: httpx.Request):
+        if request.url.path == "/admin-backend/users":
+            # only answers once the enrollments were requested too
+            await asyncio.wait_for(enrollments_requested.wait(), 1)
+            return httpx.Response(
+                200, json=[user.model_dump() for user in users.values()]
+            )
+
+        enrollments_requested.set()
+        return httpx.Response(200, json={"data": [enrollment, enrollment]})
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    result = await service.get_all_users_with_enrollments()
+    await gateway.close()
+
+    assert [user.uuid for user in result] == ["1", "2"]
+    assert [e.model_dump() for e in result[0].enrollments] == [enrollment] * 2
+    assert result[1].enrollments == []
+
+
+@pytest.mark.asyncio
+async def test_gateway_bulk_lock_status_is_bounded():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request: httpx.Request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+        if request.url.path == "/admin-backend/users/bad/lock-status":
+            return httpx.Response(404)
+        return httpx.Response(200)
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY, bulk_concurrency=4)
+
+    uuids = [str(i) for i in range(20)] + ["bad"]
+    results = await service.update_users_lock_status(uuids, True)
+    await gateway.close()
+
+    assert max_in_flight == 4
+    assert [result.uuid for result in results] == uuids
+    assert [result.status_code for result in results] == [200] * 20 + [404]
+
+
+@pytest.mark.asyncio
+async def test_gateway_bulk_enrollment_logs_once(caplog):
+    paths = []
+
+    def handler(request: httpx.Request):
+        paths.append(request.url.path)
+        return httpx.Response(200)
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    updates = [
+        EnrollmentRoleChange(courseId=str(course), uuid=uuid, role="assistant")
+        for course in range(3)
+        for uuid in ["1", "2"]
+    ]
+    with caplog.at_level(logging.INFO, logger="app"):
+        results = await service.update_users_enrollment(updates)
+    await gateway.close()
+
+    assert all(result.status_code == 200 for result in results)
+    assert sorted(paths) == sorted(
+        f"/admin-backend/courses/{u.courseId}/enrollments/{u.uuid}" for u in updates
+    )
+    assert len(caplog.records) == 1
+
+
+@pytest.mark.asyncio
+async def test_gateway_error_is_forwarded():
+    def handler(request: httpx.Request):
+        return httpx.Response(404)
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    with pytest.raises(HTTPException) as e:
+        await service.update_user_lock_status("1", True)
+    await gateway.close()
+
+    assert e.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_gateway_unreachable():
+    def handler(request: httpx.Request):
+        raise httpx.ConnectError("connection refused")
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    with pytest.raises(HTTPException) as e:
+        await service.notify_rules()
+    await gateway.close()
+
+    assert e.value.status_code == 502
+
+
+###
+#
+# Password Hashing Pool
+#
+###
+@pytest.mark.asyncio
+async def test_hasher_roundtrip():
+    hasher = PasswordHasher(workers=1)
+    hashed = await hasher.hash("password")
+
+    assert await hasher.verify("password", hashed)
+    assert not await hasher.verify("incorrect", hashed)
+    hasher.close()
+
+
+@pytest.mark.asyncio
+async def test_hasher_rejects_when_saturated():
+    hasher = PasswordHasher(workers=1, queue_size=0)
+
+    running = asyncio.create_task(hasher._run(time.sleep, 0.2))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(HasherBusy):
+        await hasher._run(time.sleep, 0)
+
+    await running
+    hasher.close()
+
+
+@pytest.mark.asyncio
+async def test_hasher_queue_timeout():
+    hasher = PasswordHasher(workers=1, queue_size=1, queue_timeout=0.05)
+
+    running = asyncio.create_task(hasher._run(time.sleep, 0.3))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(HasherBusy):
+        await hasher._run(time.sleep, 0)
+
+    await running
+    hasher.close()
+
+
+###
+#
+# Database
+#
+###
+@pytest.mark.asyncio
+async def test_dict_db_update_returns_previous_document():
+    db = DictDB()
+    created = await db.create("rules", {"title": "old", "description": "d"})
+
+    prev = await db.update("rules", created["id"], {"title": "new"})
+    assert prev == created
+
+    current = await db.find_one("rules", created["id"])
+    assert current == {**created, "title": "new"}
+
+    assert await db.update("rules", "missing", {"title": "new"}) is None
+
+
+@pytest.mark.asyncio
+async def test_dict_db_indexes_follow_writes():
+    db = DictDB()
+    await db.create_index("admins", "email", unique=True)
+    created = await db.create("admins", {"email": "a@example.com", "username": "a"})
+
+    found = await db.find_one_by_filter("admins", {"email": "a@example.com"})
+    assert found == created
+
+    await db.update("admins", created["id"], {"email": "b@example.com"})
+    assert await db.find_one_by_filter("admins", {"email": "a@example.com"}) is None
+    assert await db.exists_with_username_email("admins", "other", "b@example.com")
+
+    with pytest.raises(DuplicateKey):
+        await db.create("admins", {"email": "b@example.com", "username": "c"})
+
+    await db.delete("admins", created["id"])
+    assert await db.find_one_by_filter("admins", {"email": "b@example.com"}) is None
+    await db.create("admins", {"email": "b@example.com", "username": "c"})
+
+
+@pytest.mark.asyncio
+async def test_dict_db_index_on_existing_documents():
+    db = DictDB()
+    await db.create("rules", {"title": "same"})
+    await db.create("rules", {"title": "same"})
+
+    with pytest.raises(DuplicateKey):
+        await db.create_index("rules", "title", unique=True)
+
+    await db.create_index("rules", "title")
+    assert await db.exists_with_title("rules", "same")
+    assert not await db.exists_with_title("rules", "other")
+
+
+@pytest.mark.asyncio
+async def test_dict_db_projection():
+    db = DictDB()
+    created = await db.create("admins", {"username": "alice", "password": "hash"})
+
+    doc = await db.find_one("admins", created["id"], ["username"])
+    assert doc == {"id": created["id"], "username": "alice"}
+
+    [doc] = await db.get_all("admins", fields=["username", "missing"])
+    assert doc == {"id": created["id"], "username": "alice"}
+
+    assert (await db.find_one("admins", created["id"]))["password"] == "hash"
+
+
+@pytest.mark.asyncio
+async def test_dict_db_keeps_ids_sorted(monkeypatch):
+    # ObjectIds aren't always increasing, their counter wraps around
+    ids = iter(["b", "c", "a"])
+    monkeypatch.setattr("app.databases.dict.ObjectId", lambda: next(ids))
+    db = DictDB()
+    for title in ["b", "c", "a"]:
+        await db.create("rules", {"title": title})
+
+    assert [doc["id"] for doc in await db.get_all("rules")] == ["a", "b", "c"]
+    assert [doc["id"] for doc in await db.get_all("rules", after="a")] == ["b", "c"]
+
+    assert await db.delete("rules", "b")
+    assert [doc["id"] for doc in await db.get_all("rules")] == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_admin_reads_skip_password():
+    requested = []
+
+    class RecordingDictDB(DictDB):
+        async def find_one(self, collection, id, fields=None):
+            requested.append(fields)
+            return await super().find_one(collection, id, fields)
+
+        async def get_all(self, collection, limit=None, after=None, fields=None):
+            requested.append(fields)
+            return await super().get_all(collection, limit, after, fields)
+
+    gateway = GatewayClient("testing-url", "testing-token")
+    service = AdminService(RecordingDictDB(), gateway, SECRET_KEY)
+    admin = AdminCreate(
+        username="alice", email="alice@example.com", password="password"
+    )
+    created = await service.create_admin(admin)
+
+    assert await service.get_admin(created.id) == created
+    assert (await service.get_all_admins()).items == [created]
+    await gateway.close()
+
+    assert len(requested) == 2
+    assert all(fields and "password" not in fields for fields in requested)
+
+
+###
+#
+# Gateway Cache
+#
+###
+@pytest.mark.asyncio
+async def test_cache_serves_stale_while_refreshing():
+    loads = 0
+
+    async def loader():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.02)
+        return [loads]
+
+    cache = StaleWhileRevalidate(loader, ttl=0.05, max_stale=10)
+
+    assert await asyncio.gather(cache.get(), cache.get()) == [[1], [1]]
+    assert loads == 1
+
+    await asyncio.sleep(0.06)
+    assert await cache.get() == [1]  # stale, but answered right away
+    assert await cache.get() == [1]
+
+    await asyncio.sleep(0.03)
+    assert await cache.get() == [2]
+    assert loads == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_patches_survive_refresh():
+    async def loader():
+        await asyncio.sleep(0.02)
+        return {"locked": False}
+
+    cache = StaleWhileRevalidate(loader, ttl=0.01, max_stale=10)
+    await cache.get()
+    await asyncio.sleep(0.02)
+
+    await cache.get()  # starts a refresh
+    cache.patch(lambda value: value.update(locked=True))
+    assert await cache.get() == {"locked": True}
+
+    await asyncio.sleep(0.03)
+    assert await cache.get() == {"locked": True}
+
+
+@pytest.mark.asyncio
+async def test_gateway_lock_status_patches_cached_users():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.method)
+        if request.method == "GET":
+            return httpx.Response(
+                200, json=[user.model_dump() for user in users.values()]
+            )
+        return httpx.Response(200)
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY, cache_ttl=60)
+
+    assert not (await service.get_all_users())[0].accountLockedByAdmins
+    await service.update_user_lock_status("1", True)
+    assert (await service.get_all_users())[0].accountLockedByAdmins
+    await gateway.close()
+
+    assert requests == ["GET", "PATCH"]
+
+
+@pytest.mark.asyncio
+async def test_gateway_identical_reads_are_coalesced():
+    calls = 0
+
+    async def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json=[user.model_dump() for user in users.values()])
+
+    gateway = gateway_with_handler(handler)
+    service = AdminService(DictDB(), gateway, SECRET_KEY, cache_ttl=0)
+
+    results = await asyncio.gather(*(service.get_all_users() for _ in range(10)))
+    assert calls == 1
+    assert all(result == list(users.values()) for result in results)
+
+    await service.get_all_users()
+    await gateway.close()
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_errors():
+    calls = 0
+
+    async def fail():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise HTTPException(503)
+
+    flight = SingleFlight()
+    results = await asyncio.gather(
+        flight.do("key", fail), flight.do("key", fail), return_exceptions=True
+    )
+
+    assert calls == 1
+    assert all(isinstance(e, HTTPException) for e in results)
+
+
+###
+#
+# Gateway Circuit Breaker
+#
+###
+@pytest.mark.asyncio
+async def test_gateway_breaker_opens_and_recovers():
+    calls = 0
+    healthy = False
+
+    def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(204 if healthy else 500)
+
+    gateway = GatewayClient(
+        "http://gateway",
+        "testing-token",
+        failure_threshold=3,
+        reset_timeout=0.05,
+        transport=httpx.MockTransport(handler),
+    )
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as e:
+            await gateway.request("POST", "/notifications")
+        assert e.value.status_code == 500
+
+    with pytest.raises(HTTPException) as e:
+        await gateway.request("POST", "/notifications")
+    assert e.value.status_code == 503
+    assert calls == 3
+
+    # other endpoints have their own breaker
+    with pytest.raises(HTTPException) as e:
+        await gateway.request("POST", "/other")
+    assert e.value.status_code == 500
+
+    healthy = True
+    await asyncio.sleep(0.06)
+    await gateway.request("POST", "/notifications")
+    await gateway.request("POST", "/notifications")
+    await gateway.close()
+    assert calls == 6
+
+
+@pytest.mark.asyncio
+async def test_gateway_breaker_ignores_client_errors():
+    def handler(request: httpx.Request):
+        return httpx.Response(404)
+
+    gateway = GatewayClient(
+        "http://gateway",
+        "testing-token",
+        failure_threshold=1,
+        transport=httpx.MockTransport(handler),
+    )
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as e:
+            await gateway.request("GET", "/users")
+        assert e.value.status_code == 404
+    await gateway.close()
+
+
+def test_gateway_breaker_ignores_cancelled_calls():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0)
+    cancelled = asyncio.CancelledError()
+
+    def call(error):
+        with pytest.raises(type(error)), breaker.call():
+            raise error
+
+    # started while the circuit is closed and cancelled once it's half-open
+    slow = breaker.call()
+    slow.__enter__()
+
+    call(httpx.ConnectError("connection refused"))
+    call(cancelled)
+    assert breaker.state == CircuitState.CLOSED
+    call(httpx.ConnectError("connection refused"))
+    assert breaker.state == CircuitState.OPEN
+
+    probe = breaker.call()
+    probe.__enter__()
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    # only the probe itself frees the probe slot
+    slow.__exit__(type(cancelled), cancelled, None)
+    with pytest.raises(CircuitOpen), breaker.call():
+        pass
+    probe.__exit__(type(cancelled), cancelled, None)
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    with breaker.call():
+        pass
+    assert breaker.state == CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_gateway_retries_only_reads():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.method)
+        if len(requests) % 3:
+            return httpx.Response(503)
+        return httpx.Response(200, json=[])
+
+    gateway = gateway_with_handler(handler)
+
+    res = await gateway.request("GET", "/users")
+    assert res.json() == []
+    assert requests == ["GET"] * 3
+
+    requests.clear()
+    with pytest.raises(HTTPException) as e:
+        await gateway.request("PATCH", "/users/1/lock-status", json={})
+    await gateway.close()
+
+    assert e.value.status_code == 503
+    assert requests == ["PATCH"]
+
+
+@pytest.mark.asyncio
+async def test_gateway_breaker_shared_by_route():
+    calls = 0
+
+    def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(502)
+
+    gateway = GatewayClient(
+        "http://gateway",
+        "testing-token",
+        failure_threshold=2,
+        transport=httpx.MockTransport(handler),
+    )
+    service = AdminService(DictDB(), gateway, SECRET_KEY)
+
+    statuses = []
+    for uuid in ["1", "2", "3"]:
+        with pytest.raises(HTTPException) as e:
+            await service.update_user_lock_status(uuid, True)
+        statuses.append(e.value.status_code)
+    await gateway.close()
+
+    assert statuses == [502, 502, 503]
+    assert calls == 2
+
+
+###
+#
+# Metrics
+#
+###
+def test_metrics_sampled_on_scrape(client: TestClient):
+    threads = threading.active_count()
+    MetricsController()
+    MetricsController()
+    assert threading.active_count() == threads
+
+    res = client.get("/admins/metrics")
+    assert res.status_code == 200
+
+    samples = {
+        family.name: family.samples[0].value
+        for family in text_string_to_metric_families(res.text)
+        if family.samples
+    }
+    assert samples["memory_usage_bytes"] > 0
+    assert samples["cpu_usage_percent"] >= 0
+
+
+def test_metrics_aggregate_workers(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    worker = (
+        "from app.controllers.metrics import REQUEST_COUNT\n"
+        "REQUEST_COUNT.labels(method='GET', route='/admins', status=200).inc()\n"
+    )
+    scrape = (
+        "from app.controllers.metrics import MetricsController\n"
+        "print(MetricsController().get_metrics().body.decode())\n"
+    )
+    backend = os.path.dirname(os.path.dirname(__file__))
+
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker], env=env, cwd=backend, check=True)
+    res = subprocess.run(
+        [sys.executable, "-c", scrape],
+        env=env,
+        cwd=backend,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    [requests] = [
+        sample.value
+        for family in text_string_to_metric_families(res.stdout)
+        for sample in family.samples
+        if sample.name == "http_requests_total"
+    ]
+    assert requests == 2
+
+
+def test_metrics_drop_live_gauges_of_dead_workers(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    # exits without marking itself dead, as a crashed worker would
+    worker = (
+        "from app.controllers.metrics import HASHER_WORKERS\n"
+        "HASHER_WORKERS.set(4)\n"
+        "import os; print(os.getpid())\n"
+    )
+    scrape = (
+        "from app.controllers.metrics import MetricsController\n"
+        "print(MetricsController().get_metrics().body.decode())\n"
+    )
+    backend = os.path.dirname(os.path.dirname(__file__))
+
+    pid = subprocess.run(
+        [sys.executable, "-c", worker],
+        env=env,
+        cwd=backend,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    assert (tmp_path / f"gauge_livesum_{pid}.db").exists()
+    res = subprocess.run(
+        [sys.executable, "-c", scrape],
+        env=env,
+        cwd=backend,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    assert not (tmp_path / f"gauge_livesum_{pid}.db").exists()
+    assert "password_hasher_workers 4.0" not in res.stdout
+
+
+def test_metrics_middleware_records_streams():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/chunks/{n}")
+    async def chunks(n: int):
+        async def body():
+            for _ in range(n):
+                await asyncio.sleep(0.01)
+                yield b"x" * 100
+
+        return StreamingResponse(body())
+
+    def sample(name: str, **labels):
+        labels = {"method": "GET", "route": "/chunks/{n}", **labels}
+        return registry.get_sample_value(name, labels) or 0
+
+    count = sample("http_requests_total", status="200")
+    size = sample("http_response_size_bytes_sum")
+    latency = sample("http_request_duration_seconds_sum")
+
+    res = TestClient(app).get("/chunks/5")
+    assert res.content == b"x" * 500
+
+    assert sample("http_requests_total", status="200") == count + 1
+    assert sample("http_response_size_bytes_sum") == size + 500
+    assert sample("http_request_duration_seconds_sum") >= latency + 0.05
+
+
+def test_metrics_middleware_bounds_labels():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, max_series=3)
+    for n in range(3):
+        app.get(f"/bounded/{n}")(lambda: {})
+
+    def count(route: str, method="GET", status="200"):
+        labels = {"method": method, "route": route, "status": status}
+        return registry.get_sample_value("http_requests_total", labels) or 0
+
+    unmatched = count("<unmatched>", status="404")
+    overflow = count("<overflow>")
+    dropped = registry.get_sample_value("http_metrics_dropped_series_total")
+
+    client = TestClient(app)
+    for n in range(20):
+        client.get(f"/random-{n}")
+    client.request("BREW", "/random")
+    for n in range(3):
+        client.get(f"/bounded/{n}")
+
+    assert count("<unmatched>", status="404") == unmatched + 20
+    assert count("<unmatched>", method="OTHER", status="404") >= 1
+    assert count("/bounded/0") >= 1
+    assert count("/bounded/1") == count("/bounded/2") == 0
+    assert count("<overflow>") == overflow + 2
+    assert registry.get_sample_value("http_metrics_dropped_series_total") == dropped + 2
+
+
+###
+#
+# Logging
+#
+###
+def test_json_logs_carry_request_context(capsys):
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    loggers = [logging.getLogger(name) for name in ["app.quiet", *DEFAULT_LEVELS]]
+    logger_levels = [logger.level for logger in loggers]
+
+    listener = initialize_log("INFO", json_output=True, levels="app.quiet=ERROR")
+    app = FastAPI()
+    app.add_middleware(RequestContextMiddleware)
+
+    @app.get("/logged/{n}")
+    async def logged(n: int):
+        logging.getLogger("app.test").info("got %d", n)
+        logging.getLogger("app.quiet").info("not shown")
+        return {}
+
+    try:
+        res = TestClient(app).get("/logged/3", headers={"X-Request-ID": "abc"})
+    finally:
+        listener.stop()
+        root.handlers, root.level = handlers, level
+        for logger, logger_level in zip(loggers, logger_levels):
+            logger.setLevel(logger_level)
+
+    assert res.headers["X-Request-ID"] == "abc"
+
+    entries = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    [entry] = [e for e in entries if e["logger"] == "app.test"]
+    assert entry["message"] == "got 3"
+    assert entry["request_id"] == "abc"
+    assert entry["route"] == "/logged/{n}"
+
+    [access] = [e for e in entries if e["logger"] == "app.access"]
+    assert access["request_id"] == "abc"
+    assert access["latency_ms"] >= 0
+    assert not [e for e in entries if e["logger"] == "app.quiet"]
+
+
+def test_invalid_request_id_is_replaced():
+    app = FastAPI()
+    app.add_middleware(RequestContextMiddleware)
+    app.get("/logged")(lambda: {})
+    client = TestClient(app)
+
+    for sent in [b"\xff\xfe", b"a b", b"x" * 65]:
+        res = client.get("/logged", headers=[(b"X-Request-ID", sent)])
+        assert res.status_code == 200
+        assert res.headers["X-Request-ID"] != sent.decode("latin-1")
+        assert len(res.headers["X-Request-ID"]) == 32
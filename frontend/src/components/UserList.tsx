@@ -52,29 +52,13 @@ const UserList = () => {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const usersResponse = await api.get('/admins/users');
-        const adminsResponse = await api.get('/admins');
-        const adminsEnrollmentResponse = await api.get('/admins/courses/enrollments');
-
-        const users = usersResponse.data;
-        const enrollments = adminsEnrollmentResponse.data;
-
-        const enrollmentsMap = new Map();
-
-        enrollments.forEach(({ userId, role, course }: Enrollment) => {
-          if (!enrollmentsMap.has(userId)) {
-            enrollmentsMap.set(userId, []);
-          }
-          enrollmentsMap.get(userId).push({ role, course });
-        });
-
-        const usersWithEnrollments = users.map((user: User) => ({
-          ...user,
-          enrollments: enrollmentsMap.get(user.uuid) || [],
-        }));
+        const [usersResponse, adminsResponse] = await Promise.all([
+          api.get<User[]>('/admins/users/with-enrollments'),
+          api.get('/admins'),
+        ]);
 
         setAdmins(adminsResponse.data);
-        setUsers(usersWithEnrollments);
+        setUsers(usersResponse.data);
       } catch (error) {
         console.error('Error fetching data:', error);
       }